@@ -0,0 +1,137 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+
+
+HASH_CHUNK = 1 << 20
+
+
+def hashBytes(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def safeJoin(root, relPath):
+    #joins an untrusted archive or manifest path to root, absolute paths and paths leaving root raise ValueError
+    #both separators and drive letters are checked so a name that is harmless here cannot escape on Windows either
+    normalized = os.path.normpath(relPath)
+    parts = normalized.replace("\\", "/").split("/")
+    drive = parts[0][:2]
+    if (os.path.isabs(normalized) or os.path.splitdrive(normalized)[0] or not parts[0] or (drive[:1].isalpha() and drive[1:] == ":")
+            or normalized == os.curdir or os.pardir in parts):
+        raise ValueError(f"Unsafe path in archive: {relPath}")
+    return os.path.join(root, normalized)
+
+
+class BlobStore:
+    #content addressed store, every unique payload is written once under objects/<2 hex>/<digest>
+    #archives are recorded as manifests mapping their relative paths to digests
+    def __init__(self, root):
+        self.root = root
+        self.objectsDir = os.path.join(root, "objects")
+        self.manifestsDir = os.path.join(root, "manifests")
+        os.makedirs(self.objectsDir, exist_ok=True)
+        os.makedirs(self.manifestsDir, exist_ok=True)
+    
+    def blobPath(self, digest):
+        return os.path.join(self.objectsDir, digest[:2], digest)
+    
+    def has(self, digest):
+        return os.path.exists(self.blobPath(digest))
+    
+    def tempPath(self, digest):
+        folder = os.path.dirname(self.blobPath(digest))
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, f".{digest}.{uuid.uuid4().hex}.tmp")
+    
+    def commit(self, tmpPath, digest):
+        #os.replace is atomic, two workers storing the same payload simply write the same blob
+        os.replace(tmpPath, self.blobPath(digest))
+    
+    def put(self, data):
+        digest = hashBytes(data)
+        if not self.has(digest):
+            tmpPath = self.tempPath(digest)
+            with open(tmpPath, "wb") as f:
+                f.write(data)
+            self.commit(tmpPath, digest)
+        return digest
+    
+    def putRange(self, srcPath, offset, size, copy = None):
+        #hashes a byte range of a file in chunks and only copies it when the content is new
+        #copy(dstPath, offset, size) can be given to copy with a faster method than read/write
+        hasher = hashlib.blake2b(digest_size=16)
+        with open(srcPath, "rb") as src:
+            src.seek(offset)
+            remaining = size
+            while remaining:
+                data = src.read(min(HASH_CHUNK, remaining))
+                if not data:
+                    raise EOFError(f"{srcPath} ended before {offset + size}")
+                hasher.update(data)
+                remaining -= len(data)
+            
+            digest = hasher.hexdigest()
+            if self.has(digest):
+                return digest
+            
+            tmpPath = self.tempPath(digest)
+            if copy is not None:
+                copy(tmpPath, offset, size)
+            else:
+                src.seek(offset)
+                with open(tmpPath, "wb") as dst:
+                    remaining = size
+                    while remaining:
+                        data = src.read(min(HASH_CHUNK, remaining))
+                        dst.write(data)
+                        remaining -= len(data)
+        
+        self.commit(tmpPath, digest)
+        return digest
+    
+    def get(self, digest):
+        with open(self.blobPath(digest), "rb") as f:
+            return f.read()
+    
+    def manifestPath(self, name):
+        return os.path.join(self.manifestsDir, name + ".json")
+    
+    def writeManifest(self, name, entries):
+        with open(self.manifestPath(name), "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=1)
+    
+    def readManifest(self, name):
+        with open(self.manifestPath(name), "r", encoding="utf-8") as f:
+            return json.load(f)
+    
+    def materialize(self, name, outDir, link = False):
+        #recreates an archive's files from the store, copies by default
+        #with link the files are hard links to the blobs, which are made read-only first
+        #so editing a materialized file cannot change the stored content behind its digest
+        entries = self.readManifest(name)
+        outPaths = {relPath: safeJoin(outDir, relPath) for relPath in entries}
+        for relPath, digest in entries.items():
+            outPath = outPaths[relPath]
+            os.makedirs(os.path.dirname(outPath) or ".", exist_ok=True)
+            if os.path.exists(outPath):
+                os.remove(outPath)
+            if link:
+                try:
+                    os.chmod(self.blobPath(digest), 0o444)
+                    os.link(self.blobPath(digest), outPath)
+                    continue
+                except OSError:
+                    pass
+            shutil.copyfile(self.blobPath(digest), outPath)
+        return entries
+    
+    def stats(self):
+        count = size = 0
+        for folder, dirs, files in os.walk(self.objectsDir):
+            for file in files:
+                if not file.endswith(".tmp"):
+                    count += 1
+                    size += os.path.getsize(os.path.join(folder, file))
+        return count, size
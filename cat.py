@@ -1,5 +1,8 @@
 from .utils.PyBinaryReader.binary_reader import *
+from .cats import readCString
 import os
+import mmap
+import struct
 class CAT(BrStruct):
     def __init__(self):
         self.name = ""
@@ -8,8 +11,11 @@ class CAT(BrStruct):
         self.flags = 0
         self.content = []
         
-    def __br_read__(self, br: BinaryReader, file_name = "") -> None:
+    def __br_read__(self, br: BinaryReader, file_name = "", base = 0, source = None) -> None:
+        #offsets inside a CAT are relative to its start, nested CATs are parsed in place at base
+        #leaves become memoryviews over source when it is given, so nothing is copied per level
         self.name = file_name
+        self.offset = base
         self.flags = br.read_uint32()
         self.contentCount = br.read_uint32()
         self.catType = br.read_uint32()
@@ -23,13 +29,8 @@ class CAT(BrStruct):
             nameOffsets = br.read_uint32(self.contentCount)
         
         for i in range(self.contentCount):
-            br.seek(offsets[i], Whence.BEGIN)
-            
-            catData = br.read_bytes(sizes[i])
-            
-            catBuf = BinaryReader(catData)
-            subCat = catBuf.read_struct(subCAT, None, file_name, self.flags)
-
+            br.seek(base + offsets[i], Whence.BEGIN)
+            subCat = br.read_struct(subCAT, None, file_name, self.flags, base + offsets[i], source, sizes[i])
             
             self.content.append(subCat)
 
@@ -39,8 +40,11 @@ class subCAT(BrStruct):
         self.content = []
         
         
-    def __br_read__(self, br: BinaryReader, file_name = "", parentFlags = 0) -> None:
+    def __br_read__(self, br: BinaryReader, file_name = "", parentFlags = 0, base = 0, source = None, size = None) -> None:
+        #size is the block size from the parent CAT, leaves must lie inside it
         self.name = file_name
+        self.offset = base
+        self.size = size
         self.flags = br.read_uint32()
         self.contentCount = br.read_uint32()
         self.catType = br.read_uint32()
@@ -54,20 +58,17 @@ class subCAT(BrStruct):
             nameOffsets = br.read_uint32(self.contentCount)
         
         for i in range(self.contentCount):
-            br.seek(offsets[i], Whence.BEGIN)
-            
-            catData = br.read_bytes(sizes[i])
             if parentFlags & 2:
-                br.seek(nameOffsets[i], Whence.BEGIN)
+                br.seek(base + nameOffsets[i], Whence.BEGIN)
                 catName = br.read_str()
             else:
                 catName = file_name
             
             if self.catType == 0 and self.headerSize > 16:
-                catBuf = BinaryReader(catData)
-                subCat = catBuf.read_struct(CAT, None, catName)
+                br.seek(base + offsets[i], Whence.BEGIN)
+                subCat = br.read_struct(CAT, None, catName, base + offsets[i], source)
             else:
-                subCat = catData
+                subCat = readCATData(br, base + offsets[i], sizes[i], source, None if size is None else base + size)
             
             self.content.append(subCat)
 
@@ -76,8 +77,9 @@ class catTextures(BrStruct):
         self.content = []
         
         
-    def __br_read__(self, br: BinaryReader, file_name = "", parentFlags = 0) -> None:
+    def __br_read__(self, br: BinaryReader, file_name = "", parentFlags = 0, base = 0, source = None) -> None:
         self.name = file_name
+        self.offset = base
         self.flags = br.read_uint32()
         self.contentCount = br.read_uint32()
         self.catType = br.read_uint32()
@@ -91,47 +93,77 @@ class catTextures(BrStruct):
             nameOffsets = br.read_uint32(self.contentCount)
         
         for i in range(self.contentCount):
-            br.seek(offsets[i], Whence.BEGIN)
-            
-            catData = br.read_bytes(sizes[i])
             if parentFlags & 2:
-                br.seek(nameOffsets[i], Whence.BEGIN)
+                br.seek(base + nameOffsets[i], Whence.BEGIN)
                 catName = br.read_str()
             else:
                 catName = file_name
             
             if self.catType == 0 and self.headerSize > 16:
-                catBuf = BinaryReader(catData)
-                subCat = catBuf.read_struct(CAT, None, catName)
+                br.seek(base + offsets[i], Whence.BEGIN)
+                subCat = br.read_struct(CAT, None, catName, base + offsets[i], source)
             else:
-                subCat = catData
+                subCat = readCATData(br, base + offsets[i], sizes[i], source)
             
             self.content.append(subCat)
 
-if __name__ == "__main__":
-    tmo_path = r"F:\SteamLibrary\steamapps\common\Senran Kagura Burst ReNewal\GameData\Model\Playable\pl00_00\pl00_00_H.cat"
-    file_name = os.path.splitext(os.path.basename(tmo_path))[0]
+def readCATData(br: BinaryReader, offset, size, source = None, end = None):
+    #end bounds the block the entry belongs to, slices of source would otherwise be cut short silently
+    if end is None:
+        end = len(source) if source is not None else br.size()
+    if offset + size > end:
+        raise ValueError(f"CAT entry at {offset} with size {size} runs past the end of its block at {end}")
+    if source is not None:
+        return memoryview(source)[offset: offset + size]
+    br.seek(offset, Whence.BEGIN)
+    return br.read_bytes(size)
+
+
+def readCAT(path, file_name = None):
+    #parses the whole tree over an mmap of the file, leaf data are views into the mapping
+    if file_name is None:
+        file_name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "rb") as f:
+        source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    br = BinaryReader(source)
+    return br.read_struct(CAT, None, file_name, 0, source)
+
+def iterCATEntries(source, file_name = "", base = 0, folder = ""):
+    #walks only the CAT/subCAT headers and yields (relative path, absolute offset, size) for every leaf
+    #a CAT with flags & 1 gets its own folder, the same layout the game tools unpack to
+    flags, contentCount, catType = struct.unpack_from("<3I", source, base)
+    offsets = struct.unpack_from(f"<{contentCount}I", source, base + 12)
     
-    def dumpCat(cat:CAT, cattype, export_path):
-        if cattype == 0:
-            if cat.flags & 1:
-                #create a folder
-                path = os.path.dirname(export_path)
-                if cat.catType == 0:
-                    path = os.path.join(path, cat.name)
-                    os.makedirs(path, exist_ok=True)
-            else:
-                path = export_path
-            
-            for content, contentType in zip(cat.content, cat.types):
-                dumpCat(content, path)
+    if flags & 1 and catType == 0:
+        folder = os.path.join(folder, file_name)
     
-    with open(tmo_path, "rb") as f:
-        data = f.read()
-        br = BinaryReader(data)
-        cat = CAT()
-        cat.__br_read__(br, file_name)
-        
-        dumpCat(cat, 0, tmo_path)
+    for i in range(contentCount):
+        yield from iterSubCATEntries(source, file_name, flags, base + offsets[i], folder, i)
+
+
+def iterSubCATEntries(source, file_name, parentFlags, base, folder, index):
+    flags, contentCount, catType, headerSize = struct.unpack_from("<3IQ", source, base)
+    offsets = struct.unpack_from(f"<{contentCount}I", source, base + 20)
+    sizes = struct.unpack_from(f"<{contentCount}I", source, base + 20 + contentCount * 4)
+    if parentFlags & 2:
+        nameOffsets = struct.unpack_from(f"<{contentCount}I", source, base + 20 + contentCount * 8)
+    
+    for i in range(contentCount):
+        if parentFlags & 2:
+            catName = readCString(source, base + nameOffsets[i])
+        else:
+            catName = ""
         
-        print("")
\ No newline at end of file
+        if catType == 0 and headerSize > 16:
+            yield from iterCATEntries(source, catName or file_name, base + offsets[i], folder)
+        else:
+            yield os.path.join(folder, catName or f"{file_name}_{index}_{i}"), base + offsets[i], sizes[i]
+
+
+if __name__ == "__main__":
+    from .extract import extractArchive
+    
+    tmo_path = r"F:\SteamLibrary\steamapps\common\Senran Kagura Burst ReNewal\GameData\Model\Playable\pl00_00\pl00_00_H.cat"
+    
+    extracted = extractArchive(tmo_path)
+    print(f"{len(extracted)} files extracted")
@@ -1,13 +1,27 @@
 from .utils.PyBinaryReader.binary_reader import *
+from collections import namedtuple
+import io
+import json
+import mmap
+import os
+import shutil
+import struct
+
+
+CATSEntry = namedtuple("CATSEntry", ["name", "offset", "size", "headerPos"])
+CATS_COPY_CHUNK = 1 << 20
 
 
 class CATS(BrStruct):
     def __init__(self):
+        self.magic = "CATS"
         self.name = ""
+        self.unk = 0
         self.catCount = 0
         self.subNames = []
         self.subData = []
         self.subCATS = []
+        self.order = {}
     
     def __br_read__(self, br: BinaryReader) -> None:
         
@@ -29,6 +43,8 @@ class CATS(BrStruct):
             br.seek(pos, Whence.BEGIN)
             br.align_pos(16)
             
+            self.order.setdefault(catName, i)
+            
             #check the magic of the subcat
             subCatMagic = catData[:4].decode('utf-8')
             if subCatMagic != "CATS":
@@ -45,11 +61,412 @@ class CATS(BrStruct):
             del catData
     
     def __br_write__(self, br: BinaryReader) -> None:
-        br.write_str(self.magic)
-        br.write_uint32(self.unk)
-        br.write_uint32(len(self.subCATS))
-        br.write_uint32(0)
-            
+        stream = io.BytesIO()
+        self.write(stream)
+        br.write_bytes(stream.getvalue())
+    
+    def entries(self):
+        #(name, payload) pairs built from the sub lists, so edits to them are always written
+        #entries read from a file keep their archive position, new or renamed ones follow in list order
+        entries = list(zip(self.subNames, self.subData)) + [(subCat.name, subCat) for subCat in self.subCATS]
+        return sorted(entries, key=lambda entry: self.order.get(entry[0], len(self.order)))
+    
+    def write(self, dst):
+        return writeCATS(dst, self.entries(), self.unk)
+
+
+class LazyCATS:
+    #reads only the header tables of a CATS archive and hands out entries on demand
+    #source can be an mmap, bytes or bytearray, offsets of the entries are relative to base
+    def __init__(self, source, base = 0, size = None, name = ""):
+        self.name = name
+        self.source = source
+        self.base = base
+        self.size = len(source) - base if size is None else size
+        self.children = {}
+        
+        magic = bytes(source[base: base + 4]).decode("utf-8", "replace")
+        if magic != "CATS":
+            raise ValueError("Invalid CATS magic. Expected 'CATS', got: " + magic)
+        self.magic = magic
+        self.unk, self.catCount, self.headersOffset = struct.unpack_from("<3I", source, base + 4)
+        
+        self.entries = []
+        pos = base + 16 + self.headersOffset
+        for i in range(self.catCount):
+            nameOffset, dataOffset, dataSize = struct.unpack_from("<3Q", source, pos)
+            self.entries.append(CATSEntry(readCString(source, base + nameOffset), dataOffset, dataSize, pos))
+            #entry headers are aligned to 16 bytes relative to the start of this CATS
+            pos = base + alignOffset(pos + 24 - base, 16)
+        
+        self.names = {}
+        for i, entry in enumerate(self.entries):
+            self.names.setdefault(entry.name, i)
+    
+    def __len__(self):
+        return self.catCount
+    
+    def __iter__(self):
+        return iter(entry.name for entry in self.entries)
+    
+    def __contains__(self, name):
+        return name in self.names
+    
+    def __getitem__(self, key):
+        index = self.names[key] if isinstance(key, str) else key
+        if self.isCATS(index):
+            return self.child(index)
+        return self.view(index)
+    
+    def index(self, name):
+        return self.names[name]
+    
+    def view(self, index):
+        #zero copy slice of the entry's data
+        entry = self.entries[index]
+        start = self.base + entry.offset
+        return memoryview(self.source)[start: start + entry.size]
+    
+    def isCATS(self, index):
+        entry = self.entries[index]
+        start = self.base + entry.offset
+        return entry.size >= 16 and self.source[start: start + 4] == b"CATS"
+    
+    def child(self, index):
+        #nested CATS are only parsed the first time they are accessed
+        subCat = self.children.get(index)
+        if subCat is None:
+            entry = self.entries[index]
+            subCat = LazyCATS(self.source, self.base + entry.offset, entry.size, entry.name)
+            self.children[index] = subCat
+        return subCat
+    
+    def walk(self, folder = ""):
+        #yields (relative path, absolute offset, size) for every leaf, nested CATS become folders
+        for i, entry in enumerate(self.entries):
+            path = os.path.join(folder, entry.name)
+            if self.isCATS(i):
+                yield from self.child(i).walk(path)
+            else:
+                yield path, self.base + entry.offset, entry.size
+    
+    def close(self):
+        #closes the underlying mmap, views returned by view() must be released first
+        self.children.clear()
+        if isinstance(self.source, mmap.mmap):
+            self.source.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CATSIndex:
+    #flat table of contents for a CATS archive, including nested CATS
+    #maps "parent/child/name" paths to (absolute offset, size, isCATS)
+    def __init__(self):
+        self.entries = {}
+        self.fileSize = 0
+        self.mtime = 0
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __contains__(self, path):
+        return path in self.entries
+    
+    def __getitem__(self, path):
+        return self.entries[path]
+    
+    def addCATS(self, cats: LazyCATS, prefix = ""):
+        for i, entry in enumerate(cats.entries):
+            path = prefix + entry.name
+            isCATS = cats.isCATS(i)
+            self.entries.setdefault(path, (cats.base + entry.offset, entry.size, isCATS))
+            if isCATS:
+                self.addCATS(cats.child(i), path + "/")
+    
+    def read(self, f, path):
+        #reads a single entry from an open archive handle
+        offset, size, isCATS = self.entries[path]
+        f.seek(offset)
+        return f.read(size)
+    
+    def isStale(self, archivePath):
+        stat = os.stat(archivePath)
+        return stat.st_size != self.fileSize or stat.st_mtime_ns != self.mtime
+    
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"fileSize": self.fileSize,
+                       "mtime": self.mtime,
+                       "entries": self.entries}, f, ensure_ascii=False)
+    
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls()
+        index.fileSize = data["fileSize"]
+        index.mtime = data["mtime"]
+        index.entries = {path: tuple(entry) for path, entry in data["entries"].items()}
+        return index
+    
+    @classmethod
+    def build(cls, archivePath):
+        stat = os.stat(archivePath)
+        index = cls()
+        index.fileSize = stat.st_size
+        index.mtime = stat.st_mtime_ns
+        with readCATS(archivePath, lazy=True) as cats:
+            index.addCATS(cats)
+        return index
+
+
+def loadCATSIndex(archivePath, sidecarPath = None, save = True):
+    #reuses the sidecar index when it still matches the archive, otherwise rebuilds it
+    if sidecarPath is None:
+        sidecarPath = archivePath + ".idx"
+    
+    if os.path.exists(sidecarPath):
+        try:
+            index = CATSIndex.load(sidecarPath)
+            if not index.isStale(archivePath):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+    
+    index = CATSIndex.build(archivePath)
+    if save:
+        index.save(sidecarPath)
+    return index
+
+
+def writeCATS(dst, entries, unk = 0):
+    #writes a CATS archive to a path or a seekable file object
+    #entries are (name, payload) pairs, payloads can be bytes-like, a file path, a CATS or a LazyCATS
+    #headers are reserved first and back-patched, payloads are streamed straight into the output
+    if isinstance(dst, (str, os.PathLike)):
+        with open(dst, "wb") as f:
+            return writeCATS(f, entries, unk)
+    
+    f = dst
+    entries = list(entries)
+    base = f.tell()
+    count = len(entries)
+    
+    f.write(struct.pack("<4s3I", b"CATS", unk, count, 0))
+    f.write(bytes(32 * count))
+    
+    nameOffsets = []
+    namesSize = 16 + 32 * count
+    for name, payload in entries:
+        encoded = name.encode("utf-8") + b"\x00"
+        nameOffsets.append(namesSize)
+        f.write(encoded)
+        namesSize += len(encoded)
+    padCATS(f, base)
+    
+    table = bytearray()
+    for i, (name, payload) in enumerate(entries):
+        dataOffset = f.tell() - base
+        dataSize = writeCATSPayload(f, payload)
+        padCATS(f, base)
+        table += struct.pack("<3Q8x", nameOffsets[i], dataOffset, dataSize)
+    
+    end = f.tell()
+    f.seek(base + 16)
+    f.write(table)
+    f.seek(end)
+    return end - base
+
+
+def writeCATSPayload(f, payload):
+    if isinstance(payload, CATS):
+        return payload.write(f)
+    
+    if isinstance(payload, LazyCATS):
+        #nested archives are laid out again, which also drops any dead space inside them
+        return writeCATS(f, [(entry.name, payload[i]) for i, entry in enumerate(payload.entries)], payload.unk)
+    
+    if isinstance(payload, (str, os.PathLike)):
+        with open(payload, "rb") as src:
+            start = f.tell()
+            shutil.copyfileobj(src, f, CATS_COPY_CHUNK)
+            return f.tell() - start
+    
+    f.write(payload)
+    return memoryview(payload).nbytes
+
+
+def padCATS(f, base, alignment = 16):
+    pad = -(f.tell() - base) % alignment
+    if pad:
+        f.write(bytes(pad))
+
+
+def resolveCATSPath(root: LazyCATS, entryPath):
+    #returns [(cats, index), ...] from the root down to the entry at "parent/child/name"
+    chain = []
+    cats = root
+    parts = entryPath.split("/")
+    for depth, name in enumerate(parts):
+        if name not in cats:
+            raise KeyError(f"{entryPath}: no entry named {name}")
+        index = cats.index(name)
+        chain.append((cats, index))
+        if depth != len(parts) - 1:
+            if not cats.isCATS(index):
+                raise KeyError(f"{entryPath}: {name} is not a CATS")
+            cats = cats.child(index)
+    return chain
+
+
+def chainLayout(chain):
+    #plain numbers describing a chain so the mmap can be closed before anything is written
+    return [(cats.base, cats.entries[index]) for cats, index in chain]
+
+
+def growCATSChain(f, layout, end):
+    #nested CATS are read as a slice of their parent, so every ancestor has to cover data appended at end
+    for base, entry in layout:
+        childBase = base + entry.offset
+        if end - childBase > entry.size:
+            f.seek(entry.headerPos + 16)
+            f.write(struct.pack("<Q", end - childBase))
+
+
+def appendCATSData(f, data):
+    f.seek(0, os.SEEK_END)
+    padCATS(f, 0)
+    start = f.tell()
+    f.write(data)
+    return start, f.tell()
+
+
+def readCATSLayout(path, entryPath):
+    #header positions of an entry and its ancestors, read through an mmap that is closed again before writing
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            return chainLayout(resolveCATSPath(LazyCATS(source), entryPath))
+
+
+def readCATSTable(path, parentPath):
+    #the entry table of the CATS at parentPath ("" for the root) plus the layout of its ancestors
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            cats = LazyCATS(source)
+            chain = resolveCATSPath(cats, parentPath) if parentPath else []
+            if chain:
+                cats = chain[-1][0].child(chain[-1][1])
+            nameOffsets = [struct.unpack_from("<Q", source, entry.headerPos)[0] for entry in cats.entries]
+            return chainLayout(chain), cats.base, list(cats.entries), nameOffsets
+
+
+def replaceCATSEntry(path, entryPath, data):
+    #overwrites the payload in place when it fits, otherwise appends it and re-points the entry
+    #only the entry's header fields, the payload and the sizes of its ancestors are written
+    layout = readCATSLayout(path, entryPath)
+    base, entry = layout[-1]
+    size = memoryview(data).nbytes
+    
+    with open(path, "r+b") as f:
+        if size <= entry.size:
+            f.seek(base + entry.offset)
+            f.write(data)
+            f.seek(entry.headerPos + 16)
+            f.write(struct.pack("<Q", size))
+        else:
+            start, end = appendCATSData(f, data)
+            f.seek(entry.headerPos + 8)
+            f.write(struct.pack("<2Q", start - base, size))
+            growCATSChain(f, layout[:-1], end)
+
+
+def addCATSEntry(path, parentPath, name, data):
+    #the entry table can't grow in place, so a copy with the new entry is appended and headersOffset re-pointed
+    layout, base, entries, nameOffsets = readCATSTable(path, parentPath)
+    if any(entry.name == name for entry in entries):
+        raise ValueError(f"{parentPath}/{name} already exists, use replaceCATSEntry")
+    
+    with open(path, "r+b") as f:
+        f.seek(0, os.SEEK_END)
+        padCATS(f, base)
+        tableStart = f.tell()
+        namePos = tableStart + 32 * (len(entries) + 1)
+        encodedName = name.encode("utf-8") + b"\x00"
+        dataStart = base + alignOffset(namePos + len(encodedName) - base, 16)
+        
+        table = bytearray()
+        for entry, nameOffset in zip(entries, nameOffsets):
+            table += struct.pack("<3Q8x", nameOffset, entry.offset, entry.size)
+        table += struct.pack("<3Q8x", namePos - base, dataStart - base, memoryview(data).nbytes)
+        
+        f.write(table)
+        f.write(encodedName)
+        padCATS(f, base)
+        f.write(data)
+        end = f.tell()
+        
+        f.seek(base + 8)
+        f.write(struct.pack("<2I", len(entries) + 1, tableStart - base - 16))
+        growCATSChain(f, layout, end)
+
+
+def removeCATSEntry(path, entryPath):
+    #shifts the following entry headers up and decrements the count, the payload stays as dead space
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            cats, index = resolveCATSPath(LazyCATS(source), entryPath)[-1]
+            headers = [entry.headerPos for entry in cats.entries]
+            following = [source[pos: pos + 24] for pos in headers[index + 1:]]
+            base, count = cats.base, cats.catCount
+    
+    with open(path, "r+b") as f:
+        for pos, header in zip(headers[index:], following):
+            f.seek(pos)
+            f.write(header)
+        f.seek(headers[-1])
+        f.write(bytes(24))
+        f.seek(base + 8)
+        f.write(struct.pack("<I", count - 1))
+
+
+def compactCATS(path, outPath = None):
+    #rewrites the archive without the dead space left behind by in place edits
+    tmpPath = (outPath or path) + ".tmp"
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            root = LazyCATS(source)
+            with open(tmpPath, "wb") as out:
+                writeCATSPayload(out, root)
+            del root
+    os.replace(tmpPath, outPath or path)
+
+
+def alignOffset(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def readCString(source, offset, encoding = "utf-8"):
+    end = source.find(b"\x00", offset)
+    if end == -1:
+        end = len(source)
+    return bytes(source[offset: end]).decode(encoding)
+
+
+def readCATS(path, lazy = False):
+    if lazy:
+        with open(path, "rb") as f:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return LazyCATS(source)
+    
+    with open(path, "rb") as f:
+        br = BinaryReader(f.read(), Endian.LITTLE)
+        return br.read_struct(CATS)
+
 
 if __name__ == "__main__":
     file = r"G:\SteamLibrary\steamapps\common\BLEACH Rebirth of Souls\00HIGH\Model\MapAssetCat\bg000_00.cat"
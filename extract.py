@@ -0,0 +1,153 @@
+import os
+import sys
+import mmap
+import errno
+import struct
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from .cats import LazyCATS
+from .cat import iterCATEntries
+from .blobstore import BlobStore, safeJoin
+
+
+COPY_CHUNK = 1 << 20
+
+EXTENSIONS = {
+    b"tmd0": ".tmd",
+    b"CATS": ".cat",
+    b"PZZE": ".pzz",
+    b"DDS ": ".dds",
+}
+
+
+def guessExtension(data):
+    return EXTENSIONS.get(bytes(data[:4]), ".bin")
+
+
+def iterArchiveEntries(source, file_name = ""):
+    #(relative path, absolute offset, size) for every leaf of a CATS or CAT archive
+    if source[:4] == b"CATS":
+        return LazyCATS(source, name=file_name).walk()
+    return iterCATEntries(source, file_name)
+
+
+def copyRange(srcPath, srcFd, dstPath, offset, size):
+    #copies a byte range between files inside the kernel when the platform allows it
+    with open(dstPath, "wb") as dst:
+        dstFd = dst.fileno()
+        copied = 0
+        
+        for kernelCopy in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)):
+            if kernelCopy is None:
+                continue
+            try:
+                while copied < size:
+                    if kernelCopy is os.sendfile:
+                        count = os.sendfile(dstFd, srcFd, offset + copied, size - copied)
+                    else:
+                        count = os.copy_file_range(srcFd, dstFd, size - copied, offset + copied)
+                    if not count:
+                        break
+                    copied += count
+                break
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP):
+                    raise
+        
+        if copied < size:
+            #plain buffered copy, only a chunk is ever held in memory
+            with open(srcPath, "rb") as src:
+                src.seek(offset + copied)
+                while copied < size:
+                    data = src.read(min(COPY_CHUNK, size - copied))
+                    if not data:
+                        raise EOFError(f"{srcPath} ended before {offset + size}")
+                    dst.write(data)
+                    copied += len(data)
+    
+    return dstPath
+
+
+def planExtraction(path, outDir, source):
+    #maps every leaf to an output path, adds extensions and keeps duplicate names apart
+    file_name = os.path.splitext(os.path.basename(path))[0]
+    archivePath = os.path.normcase(os.path.realpath(path))
+    jobs = []
+    used = set()
+    for relPath, offset, size in iterArchiveEntries(source, file_name):
+        if not os.path.splitext(relPath)[1]:
+            relPath += guessExtension(source[offset: offset + 4])
+        
+        #entry names come from the archive, anything escaping outDir is rejected before a folder is made
+        outPath = safeJoin(outDir, relPath)
+        stem, ext = os.path.splitext(outPath)
+        n = 1
+        while os.path.normcase(outPath) in used:
+            outPath = f"{stem}_{n}{ext}"
+            n += 1
+        #outputs are opened with "wb", the archive itself is still mapped and must never be one of them
+        if outDir and os.path.normcase(os.path.realpath(outPath)) == archivePath:
+            raise ValueError(f"{relPath} would overwrite the archive {path}")
+        used.add(os.path.normcase(outPath))
+        jobs.append((outPath, offset, size))
+    return jobs
+
+
+def extractArchive(path, outDir = None, workers = None, store = None, manifestName = None):
+    #extracts a CAT or CATS archive without loading payloads into Python
+    #headers are read through an mmap, payloads are copied file to file on a thread pool
+    #with a BlobStore each unique payload is stored once and a manifest {relative path: digest} is returned
+    #outDir defaults to a folder named after the archive next to it, so entries never land beside other files
+    if outDir is None:
+        outDir = os.path.join(os.path.dirname(path), os.path.splitext(os.path.basename(path))[0])
+    
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            jobs = planExtraction(path, "" if store else outDir, source)
+        
+        srcFd = f.fileno()
+        if store is not None:
+            def storeRange(relPath, offset, size):
+                return store.putRange(path, offset, size, lambda dstPath, offset, size: copyRange(path, srcFd, dstPath, offset, size))
+            
+            with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+                futures = [pool.submit(storeRange, relPath, offset, size) for relPath, offset, size in jobs]
+                manifest = {relPath.replace(os.sep, "/"): future.result() for (relPath, offset, size), future in zip(jobs, futures)}
+            
+            store.writeManifest(manifestName or os.path.splitext(os.path.basename(path))[0], manifest)
+            return manifest
+        
+        for folder in {os.path.dirname(outPath) for outPath, offset, size in jobs}:
+            os.makedirs(folder, exist_ok=True)
+        
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = [pool.submit(copyRange, path, srcFd, outPath, offset, size) for outPath, offset, size in jobs]
+            return [future.result() for future in futures]
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Extract CAT and CATS archives.")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("-o", "--out-dir", help="output folder, defaults to a folder named after each archive next to it")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("-s", "--store", help="deduplicate payloads into a content addressed store at this folder")
+    args = parser.parse_args(argv)
+    
+    store = BlobStore(args.store) if args.store else None
+    failed = 0
+    for path in args.paths:
+        try:
+            extracted = extractArchive(path, args.out_dir, args.workers, store)
+            print(f"{path}: {len(extracted)} files")
+        except (OSError, ValueError, struct.error) as e:
+            failed += 1
+            print(f"FAILED {path}: {e}")
+    
+    if store is not None:
+        count, size = store.stats()
+        print(f"store: {count} unique blobs, {size} bytes")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,6 @@
 from .utils.PyBinaryReader.binary_reader import *
+from .extract import guessExtension
+import os
 
 
 class LDS(BrStruct):
@@ -53,3 +55,29 @@ class LDS(BrStruct):
         br.seek(sizePos)
         br.write_uint32(br.size())
 
+
+def unpackLDS(path, outDir = None, store = None, manifestName = None):
+    #writes every texture of an LDS to outDir, or into a BlobStore where identical textures are kept once
+    #returns the written paths, or the manifest {texture name: digest} when a store is used
+    #the manifest defaults to "<name>.lds" so it never replaces the manifest of an archive with the same stem
+    file_name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "rb") as f:
+        br = BinaryReader(f.read())
+    lds = br.read_struct(LDS, None, file_name)
+    
+    names = [f"{file_name}_{i:03d}{guessExtension(texture)}" for i, texture in enumerate(lds.textures)]
+    if store is not None:
+        manifest = {name: store.put(texture) for name, texture in zip(names, lds.textures)}
+        store.writeManifest(manifestName or f"{file_name}.lds", manifest)
+        return manifest
+    
+    if outDir is None:
+        outDir = os.path.join(os.path.dirname(path), file_name)
+    os.makedirs(outDir, exist_ok=True)
+    
+    paths = []
+    for name, texture in zip(names, lds.textures):
+        paths.append(os.path.join(outDir, name))
+        with open(paths[-1], "wb") as f:
+            f.write(texture)
+    return paths
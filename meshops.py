@@ -0,0 +1,189 @@
+import numpy as np
+
+
+#decoded precisions a converted vertex attribute can be kept in, u1 leaves it quantized
+VERTEX_PRECISIONS = {"u1": np.uint8, "f2": np.float16, "f4": np.float32}
+
+#layout of one entry of the bone hierarchy, shared by TMD and TMD2
+BONE_DTYPE = np.dtype([('hash', '<u4'), ('posedLocation', '<f4', 3), ('parentIndex', '<i4'), ('unk1', '<u2'), ('nameOffset', '<u2')])
+
+
+def triangleRanges(starts, counts):
+    #indices into the global triangle array for every range, concatenated in order
+    starts = np.asarray(starts, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    triangleOffsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=triangleOffsets[1:])
+
+    rangeIds = np.repeat(np.arange(len(counts)), counts)
+    indices = np.arange(triangleOffsets[-1], dtype=np.int64) + np.repeat(starts - triangleOffsets[:-1], counts)
+    return indices, rangeIds, triangleOffsets
+
+
+def buildSubmeshCSR(triangles, starts, counts):
+    #splits the global (N, 3) triangle array into submeshes in a single pass
+    #returns vertexIndices, vertexOffsets, localTriangles, triangleOffsets where submesh i uses
+    #vertexIndices[vertexOffsets[i]:vertexOffsets[i + 1]] and localTriangles[triangleOffsets[i]:triangleOffsets[i + 1]]
+    #local triangles index into that submesh's vertexIndices, which are sorted like np.unique
+    triangles = np.asarray(triangles).reshape(-1, 3)
+    indices, rangeIds, triangleOffsets = triangleRanges(starts, counts)
+    tris = triangles[indices]
+
+    vertexCount = int(tris.max()) + 1 if tris.size else 1
+    keys = (np.repeat(rangeIds, 3) * vertexCount + tris.reshape(-1)).astype(np.int64)
+    uniqueKeys, inverse = np.unique(keys, return_inverse=True)
+
+    vertexIndices = (uniqueKeys % vertexCount).astype(triangles.dtype)
+    vertexOffsets = np.searchsorted(uniqueKeys // vertexCount, np.arange(len(triangleOffsets)))
+
+    localTriangles = inverse.reshape(-1) - np.repeat(vertexOffsets[rangeIds], 3)
+    localTriangles = localTriangles.astype(triangles.dtype).reshape(-1, 3)
+    return vertexIndices, vertexOffsets, localTriangles, triangleOffsets
+
+
+def quantizeWeights8(weights, method = "round"):
+    #(N, 8) float skin weights to u1 bytes that sum to 255, all-zero rows put 255 in slot 0
+    #"round" rounds every weight and moves the error onto the largest one like the original writers did,
+    #the sum is only exact for rows that already add up to about 1
+    #"largest" scales each row to 255 and hands the leftover units to the largest fractional parts, always exact
+    weights = np.asarray(weights, dtype=np.float64).reshape(-1, 8)
+    rows = np.arange(len(weights))
+    if method == "round":
+        scaled = np.round(weights * 255).astype(np.int64)
+        diff = 255 - scaled.sum(axis=1)
+        largest = np.argmax(scaled, axis=1)
+        scaled[rows, largest] = np.clip(scaled[rows, largest] + diff, 0, 255)
+        return np.clip(scaled, 0, 255).astype(np.uint8)
+    
+    if method != "largest":
+        raise ValueError(f"Unknown weight quantization: {method}")
+    weights = np.clip(weights, 0, None)
+    totals = weights.sum(axis=1, keepdims=True)
+    scaled = np.zeros(weights.shape, dtype=np.float64)
+    np.divide(weights * 255, totals, out=scaled, where=totals > 0)
+    quantized = np.floor(scaled).astype(np.int64)
+    
+    #rank of every slot by its remainder, ties go to the lower slot
+    order = np.argsort(quantized - scaled, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    ranks[rows[:, None], order] = np.arange(8)
+    quantized += ranks < (255 - quantized.sum(axis=1))[:, None]
+    empty = totals[:, 0] <= 0
+    quantized[empty] = 0
+    quantized[empty, 0] = 255
+    return quantized.astype(np.uint8)
+
+
+def boneMatrixBytes(bones):
+    return np.asarray([bone.matrix for bone in bones], dtype='<f4').reshape(-1, 16).tobytes()
+
+
+def resolveSkinPalette(boneIDs, weights, vertexIndices, vertexOffsets, palettes):
+    #maps per-vertex palette slots to global bone indices for every submesh at once
+    #boneIDs and weights are (V, N), palettes holds the index table of each submesh in CSR order
+    #unresolved slots get -1, weights are normalized so every row with any weight sums to 1
+    boneIDs = np.asarray(boneIDs, dtype=np.int64)
+    globalIDs = np.full(boneIDs.shape, -1, dtype=np.int32)
+
+    paletteSizes = np.array([len(palette) for palette in palettes], dtype=np.int64)
+    paletteOffsets = np.zeros(len(palettes) + 1, dtype=np.int64)
+    np.cumsum(paletteSizes, out=paletteOffsets[1:])
+    flatPalettes = np.concatenate([np.asarray(palette, dtype=np.int64).reshape(-1) for palette in palettes] + [np.zeros(1, np.int64)])
+
+    vertexIndices = np.asarray(vertexIndices, dtype=np.int64)
+    submeshIds = np.repeat(np.arange(len(palettes)), np.diff(vertexOffsets))
+    local = boneIDs[vertexIndices]
+    sizes = paletteSizes[submeshIds][:, None]
+    valid = local < sizes
+    resolved = flatPalettes[paletteOffsets[submeshIds][:, None] + np.where(valid, local, 0)]
+    globalIDs[vertexIndices] = np.where(valid, resolved, -1)
+
+    weights = np.asarray(weights, dtype=np.float32)
+    totals = weights.sum(axis=1, keepdims=True)
+    normalized = np.zeros(weights.shape, dtype=np.float32)
+    np.divide(weights, totals, out=normalized, where=totals > 0)
+    return globalIDs, normalized
+
+
+class VertexBuffer:
+    #wraps the raw vertex array, vertices["normal"] converts that one attribute and keeps the result until dropCaches
+    #attributes without a converter are returned as views of the raw array, subclasses set the converters of their format
+    converters = {}
+    
+    def __init__(self, raw, precision = None):
+        self.raw = raw
+        self.cache = {}
+        self.setPrecision(precision)
+    
+    def setPrecision(self, precision = None):
+        #precision of the converted attributes, "u1" keeps the quantized bytes, "f2"/"f4" convert to float16/float32
+        #either one value for all of them or a dict per attribute name, anything missing stays "f4"
+        if precision is None or isinstance(precision, str):
+            precision = {name: precision or "f4" for name in self.converters}
+        else:
+            precision = {name: precision.get(name, "f4") for name in self.converters}
+        for name, value in precision.items():
+            if value not in VERTEX_PRECISIONS:
+                raise ValueError(f"Unknown precision for {name}: {value}")
+        
+        self.precision = precision
+        self.cache.clear()
+        
+        converted_dtype = []
+        for name in self.raw.dtype.names:
+            dtype, shape = self.raw.dtype.fields[name][0].subdtype
+            if name in self.converters and precision[name] != "u1":
+                #a converter may also change the shape, e.g. dropping the 4th normal component
+                dtype = VERTEX_PRECISIONS[precision[name]]
+                shape = self.converters[name](self.raw[name][:0]).shape[1:]
+            converted_dtype.append((name, dtype, shape))
+        self.dtype = np.dtype(converted_dtype)
+    
+    @property
+    def names(self):
+        return self.dtype.names
+    
+    def __len__(self):
+        return len(self.raw)
+    
+    def __contains__(self, name):
+        return name in self.dtype.names
+    
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            return self.asStructured(key)
+        
+        if key not in self.converters or self.precision[key] == "u1":
+            return self.raw[key]
+        
+        column = self.cache.get(key)
+        if column is None:
+            column = self.cache[key] = self.decode(key).astype(VERTEX_PRECISIONS[self.precision[key]], copy=False)
+        return column
+    
+    def decode(self, name, index = slice(None)):
+        #float32 values of an attribute for the selected vertices, converted from the raw data and not cached
+        if name in self.converters:
+            return self.converters[name](self.raw[name][index])
+        return self.raw[name][index]
+    
+    def dropCaches(self, names = None):
+        if names is None:
+            self.cache.clear()
+        else:
+            for name in names:
+                self.cache.pop(name, None)
+    
+    def asStructured(self, index = slice(None)):
+        #builds a converted structured array for the selected vertices, nothing is cached
+        raw = self.raw[index]
+        converted_vertices = np.empty(raw.shape, dtype=self.dtype)
+        for name in self.dtype.names:
+            column = self.cache.get(name)
+            if column is not None:
+                converted_vertices[name] = column[index]
+            elif name in self.converters and self.precision[name] != "u1":
+                converted_vertices[name] = self.converters[name](raw[name])
+            else:
+                converted_vertices[name] = raw[name]
+        return converted_vertices
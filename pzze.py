@@ -1,8 +1,24 @@
 import os
+import sys
+import glob
+import time
 import zlib
+import struct
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from .utils.PyBinaryReader.binary_reader import *
 
 
+PZZE_HEADER = struct.Struct("<4s4sQQ")
+DEFAULT_CHUNK_SIZE = 1 << 20
+DEFAULT_BLOCK_SIZE = 1 << 17
+DEFLATE_WINDOW = 1 << 15
+ADLER_BASE = 65521
+
+PZZEResult = namedtuple("PZZEResult", ["path", "outPath", "inSize", "outSize", "seconds", "error"])
+
+
 class PZZEFile(BrStruct):
     def __init__(self):
         self.magic = 'PZZE'
@@ -42,10 +58,14 @@ class PZZEFile(BrStruct):
             return None
         return self.decompressedData
     
-    def compress(self):
+    def compress(self, level = -1, blockSize = 0, workers = None):
+        #a blockSize enables the parallel block compressor, the output is still a single zlib stream
         if self.decompressedData:
             try:
-                self.compressedData = zlib.compress(self.decompressedData)
+                if blockSize:
+                    self.compressedData = parallelCompress(self.decompressedData, level, blockSize, workers)
+                else:
+                    self.compressedData = zlib.compress(self.decompressedData, level)
             except zlib.error:
                 print(f"Compression failed.")
                 return None
@@ -62,5 +82,282 @@ def readPZZE(path):
         return pzze
 
 
+def readPZZEHeader(f):
+    #reads the 24 byte header and leaves the handle at the start of the compressed data
+    header = f.read(PZZE_HEADER.size)
+    if len(header) < PZZE_HEADER.size:
+        raise ValueError("Truncated PZZE header.")
+    
+    magic, fileFormat, decompressedSize, dataOffset = PZZE_HEADER.unpack(header)
+    pzze = PZZEFile()
+    pzze.magic = magic.decode("utf-8", "replace")
+    if pzze.magic != "PZZE":
+        raise ValueError("Invalid PZZE magic. Expected 'PZZE', got: " + pzze.magic)
+    
+    pzze.fileFormat = fileFormat.split(b"\x00", 1)[0].decode("utf-8", "replace")
+    pzze.decompressedSize = decompressedSize
+    pzze.dataOffset = dataOffset
+    
+    #skip anything between the header and the data without assuming the handle is seekable
+    skip = dataOffset - PZZE_HEADER.size
+    while skip > 0:
+        skipped = len(f.read(min(skip, DEFAULT_CHUNK_SIZE)))
+        if not skipped:
+            raise ValueError("Truncated PZZE file.")
+        skip -= skipped
+    
+    return pzze
+
+
+def iterPZZE(f, chunkSize = DEFAULT_CHUNK_SIZE, header = None):
+    #yields the decompressed data in chunks of at most chunkSize bytes
+    #only one input chunk and one output chunk are held in memory at a time
+    if header is None:
+        header = readPZZEHeader(f)
+    
+    decompressor = zlib.decompressobj()
+    while not decompressor.eof:
+        data = f.read(chunkSize)
+        if not data:
+            break
+        
+        chunk = decompressor.decompress(data, chunkSize)
+        while chunk:
+            yield chunk
+            chunk = decompressor.decompress(decompressor.unconsumed_tail, chunkSize)
+    
+    if not decompressor.eof:
+        raise zlib.error("Truncated PZZE stream.")
+    
+    chunk = decompressor.flush()
+    if chunk:
+        yield chunk
+
+
+def decompressPZZE(src, dst, chunkSize = DEFAULT_CHUNK_SIZE):
+    #streams the decompressed data of src into dst, both can be paths or file objects
+    #returns the header with decompressedSize set to the amount of bytes written
+    srcFile = open(src, "rb") if isinstance(src, (str, os.PathLike)) else src
+    dstFile = open(dst, "wb") if isinstance(dst, (str, os.PathLike)) else dst
+    try:
+        header = readPZZEHeader(srcFile)
+        written = 0
+        for chunk in iterPZZE(srcFile, chunkSize, header):
+            dstFile.write(chunk)
+            written += len(chunk)
+    finally:
+        if srcFile is not src:
+            srcFile.close()
+        if dstFile is not dst:
+            dstFile.close()
+    
+    if written != header.decompressedSize:
+        raise ValueError(f"Decompressed size mismatch. Expected {header.decompressedSize}, got: {written}")
+    
+    return header
+
+
+def adler32Combine(adler1, adler2, len2):
+    #adler32 of the concatenation of two buffers, given the checksum and length of the second one
+    rem = len2 % ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % ADLER_BASE
+    sum1 = (sum1 + (adler2 & 0xFFFF) + ADLER_BASE - 1) % ADLER_BASE
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + ADLER_BASE - rem) % ADLER_BASE
+    return (sum2 << 16) | sum1
+
+
+def zlibHeader(level = -1):
+    #CMF for deflate with a 32K window, FLEVEL is only a hint for decoders
+    if level < 0:
+        level = 6
+    flevel = 0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3
+    cmf = 0x78
+    flg = flevel << 6
+    flg += 31 - ((cmf << 8) | flg) % 31
+    return bytes((cmf, flg))
+
+
+def deflateBlock(data, start, end, level, last):
+    #raw deflate of data[start:end] primed with the previous 32K as a preset dictionary
+    #sync flushing keeps the output byte aligned so the blocks can be concatenated
+    view = memoryview(data)
+    if start:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=view[max(0, start - DEFLATE_WINDOW): start])
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    
+    block = view[start: end]
+    compressed = compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return compressed, zlib.adler32(block), len(block)
+
+
+def parallelCompress(data, level = -1, blockSize = DEFAULT_BLOCK_SIZE, workers = None):
+    #pigz style compressor, splits data into blocks that are deflated concurrently and
+    #stitches them into one zlib stream that zlib.decompress and the game read as usual
+    size = len(data)
+    if size <= blockSize:
+        return zlib.compress(data, level)
+    
+    starts = range(0, size, blockSize)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(deflateBlock, data, start, min(start + blockSize, size), level, start + blockSize >= size)
+                   for start in starts]
+        blocks = [future.result() for future in futures]
+    
+    adler = 1
+    for compressed, blockAdler, blockLength in blocks:
+        adler = adler32Combine(adler, blockAdler, blockLength)
+    
+    return b"".join([zlibHeader(level)] + [block[0] for block in blocks] + [struct.pack(">I", adler)])
+
+
+def compressPZZE(src, dst, fileFormat = None, level = -1, chunkSize = DEFAULT_CHUNK_SIZE, blockSize = 0, workers = None):
+    #streams src into a PZZE file, dst has to be seekable so the size can be patched at the end
+    #with a blockSize the source is loaded whole and compressed with parallelCompress instead
+    if fileFormat is None:
+        fileFormat = formatFromPath(src) if isinstance(src, (str, os.PathLike)) else "tmd2"
+    
+    srcFile = open(src, "rb") if isinstance(src, (str, os.PathLike)) else src
+    dstFile = open(dst, "wb") if isinstance(dst, (str, os.PathLike)) else dst
+    try:
+        headerPos = dstFile.tell()
+        dstFile.write(PZZE_HEADER.pack(b"PZZE", fileFormat.encode("utf-8")[:4], 0, PZZE_HEADER.size))
+        
+        if blockSize:
+            data = srcFile.read()
+            read = len(data)
+            dstFile.write(parallelCompress(data, level, blockSize, workers))
+        else:
+            compressor = zlib.compressobj(level)
+            read = 0
+            while True:
+                data = srcFile.read(chunkSize)
+                if not data:
+                    break
+                read += len(data)
+                dstFile.write(compressor.compress(data))
+            dstFile.write(compressor.flush())
+        
+        endPos = dstFile.tell()
+        dstFile.seek(headerPos + 8)
+        dstFile.write(struct.pack("<Q", read))
+        dstFile.seek(endPos)
+    finally:
+        if srcFile is not src:
+            srcFile.close()
+        if dstFile is not dst:
+            dstFile.close()
+    
+    return read
+
+
+def formatFromPath(path):
+    #the format field is the file extension truncated to 4 characters, e.g. "tmd2" or "tact"
+    ext = os.path.splitext(os.fspath(path))[1][1:]
+    return ext[:4] if ext else "tmd2"
+
+
+def expandPaths(patterns):
+    paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            paths.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            paths.append(pattern)
+    return [path for path in paths if os.path.isfile(path)]
+
+
+def processPZZE(path, outPath, mode = "decompress", fileFormat = None, level = -1, chunkSize = DEFAULT_CHUNK_SIZE, blockSize = 0):
+    #decompresses or compresses a single file, writing through a temporary file so that
+    #a failure never leaves a half written output and in place conversion is possible
+    start = time.perf_counter()
+    inSize = outSize = 0
+    tmpPath = outPath + ".tmp"
+    try:
+        inSize = os.path.getsize(path)
+        outDir = os.path.dirname(outPath)
+        if outDir:
+            os.makedirs(outDir, exist_ok=True)
+        
+        if mode == "decompress":
+            decompressPZZE(path, tmpPath, chunkSize)
+        elif mode == "compress":
+            compressPZZE(path, tmpPath, fileFormat or formatFromPath(path), level, chunkSize, blockSize)
+        else:
+            raise ValueError(f"Unknown PZZE mode: {mode}")
+        
+        os.replace(tmpPath, outPath)
+        outSize = os.path.getsize(outPath)
+        error = None
+    except (OSError, ValueError, zlib.error) as e:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        error = f"{type(e).__name__}: {e}"
+    
+    return PZZEResult(path, outPath, inSize, outSize, time.perf_counter() - start, error)
+
+
+def batchPZZE(paths, outDir = None, mode = "decompress", workers = None, root = None,
+              fileFormat = None, level = -1, chunkSize = DEFAULT_CHUNK_SIZE, blockSize = 0, callback = None):
+    #runs processPZZE over many files on a thread pool, zlib releases the GIL so this scales with cores
+    #files are converted in place when outDir is None, otherwise written to outDir keeping their path relative to root
+    paths = expandPaths(paths)
+    if root is None and outDir is not None and paths:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    
+    def outPathFor(path):
+        if outDir is None:
+            return path
+        return os.path.join(outDir, os.path.relpath(os.path.abspath(path), root))
+    
+    results = []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(processPZZE, path, outPathFor(path), mode, fileFormat, level, chunkSize, blockSize) for path in paths]
+        for future in futures:
+            result = future.result()
+            results.append(result)
+            if callback:
+                callback(result)
+    
+    return results
+
+
+def uncompressedSize(result):
+    return max(result.inSize, result.outSize)
+
+
+def printPZZEResult(result):
+    if result.error:
+        print(f"FAILED {result.path}: {result.error}")
+    else:
+        #throughput is measured on the uncompressed side in both directions
+        throughput = uncompressedSize(result) / result.seconds / (1 << 20) if result.seconds else 0.0
+        print(f"{result.path} -> {result.outPath} ({result.inSize} -> {result.outSize} bytes, {throughput:.1f} MB/s)")
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Batch compress or decompress PZZE files.")
+    parser.add_argument("mode", choices=["decompress", "compress"])
+    parser.add_argument("paths", nargs="+", help="files or glob patterns (** is recursive)")
+    parser.add_argument("-o", "--out-dir", help="output folder, files are converted in place when omitted")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("-l", "--level", type=int, default=-1, help="zlib compression level")
+    parser.add_argument("-f", "--format", default=None, help="PZZE format field, defaults to the file extension")
+    parser.add_argument("-b", "--block-size", type=int, default=0, help="compress each file in parallel blocks of this size")
+    args = parser.parse_args(argv)
+    
+    start = time.perf_counter()
+    results = batchPZZE(args.paths, args.out_dir, args.mode, args.workers,
+                        fileFormat=args.format, level=args.level, blockSize=args.block_size, callback=printPZZEResult)
+    elapsed = time.perf_counter() - start
+    
+    failed = [result for result in results if result.error]
+    total = sum(uncompressedSize(result) for result in results if not result.error)
+    print(f"{len(results) - len(failed)}/{len(results)} files, {total / (1 << 20):.1f} MB in {elapsed:.2f}s "
+          f"({total / elapsed / (1 << 20) if elapsed else 0.0:.1f} MB/s)")
+    return 1 if failed else 0
+
+
 if __name__ == "__main__":
-    pass
+    sys.exit(main())
@@ -0,0 +1,261 @@
+from .utils.PyBinaryReader.binary_reader import *
+from .pzze import iterPZZE, expandPaths
+from .tmd import TMD
+from .tmd2 import TMD2
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import argparse
+import sqlite3
+import csv
+import sys
+import os
+
+#enough for the largest fixed header, PZZE files are only inflated this far unless tables are requested
+SCAN_HEADER_SIZE = 0x200
+SCAN_CHUNK_SIZE = 1 << 14
+
+MODEL_KINDS = {"tmd": TMD, "tmd2": TMD2}
+
+INTEGER_COLUMNS = ["fileSize", "version", "modelFlags", "animFlag", "vertexCount", "trianglesCount", "subMeshCount",
+                   "modelCount", "materialCount", "textureCount", "boneCount",
+                   "verticesOffset", "trianglesOffset", "materialsOffset", "texturesOffset"]
+FLOAT_COLUMNS = [f"boundingBox{i}" for i in range(6)]
+STRING_COLUMNS = ["path", "kind", "shaders", "textures"]
+INDEX_COLUMNS = ["path", "kind"] + INTEGER_COLUMNS + FLOAT_COLUMNS + ["shaders", "textures"]
+
+
+class FilePrefix:
+    #the first bytes of a model file, compressed files are inflated only as far as they are read
+    def __init__(self, f):
+        self.f = f
+        self.data = bytearray()
+        self.chunks = None
+        if f.read(4) == b"PZZE":
+            f.seek(0)
+            self.chunks = iterPZZE(f, SCAN_CHUNK_SIZE)
+        else:
+            f.seek(0)
+
+    def read(self, size):
+        while len(self.data) < size:
+            if self.chunks is not None:
+                chunk = next(self.chunks, b"")
+            else:
+                chunk = self.f.read(size - len(self.data))
+            if not chunk:
+                break
+            self.data += chunk
+        return bytes(self.data)
+
+
+def modelKind(path):
+    kind = os.path.splitext(path)[1].lower().lstrip(".")
+    if kind not in MODEL_KINDS:
+        raise ValueError(f"Unknown model type: {path}")
+    return kind
+
+
+def tablesEnd(model):
+    #end of the texture, material texture, shader param and material tables
+    return max(model.texturesOffset + model.textureCount * 12,
+               model.materialTexturesOffset + model.materialTextureCount * 12,
+               model.shaderParamsOffset + model.shaderParamsCount * 8,
+               model.materialsOffset + model.materialCount * 20)
+
+
+def readModelHeader(kind, data, tables = False):
+    br = BinaryReader(data)
+    if kind == "tmd2":
+        #lazy, so the tables are only decoded if they are accessed
+        return br.read_struct(TMD2, None, "", True)
+
+    model = TMD()
+    model.readHeader(br)
+    if tables:
+        model.readMaterials(br)
+    return model
+
+
+def scanModel(path, kind = None, tables = False):
+    #returns one index row, only the header (and optionally the material tables) is read
+    kind = kind or modelKind(path)
+    with open(path, "rb") as f:
+        prefix = FilePrefix(f)
+        model = readModelHeader(kind, prefix.read(SCAN_HEADER_SIZE))
+        if tables:
+            model = readModelHeader(kind, prefix.read(tablesEnd(model)), True)
+
+    row = {"path": path, "kind": kind, "fileSize": os.path.getsize(path)}
+    for name in INTEGER_COLUMNS[1:]:
+        row[name] = int(getattr(model, name, 0))
+    for i, value in enumerate(model.boundingBox):
+        row[f"boundingBox{i}"] = value
+
+    row["shaders"] = row["textures"] = ""
+    if tables:
+        row["shaders"] = ",".join(sorted({material.shaderID for material in model.materials}))
+        row["textures"] = ",".join(f"{texture.hash:08x}" for texture in model.textures)
+    return row
+
+
+def emptyColumns(count = 0):
+    columns = {}
+    for name in INDEX_COLUMNS:
+        if name in INTEGER_COLUMNS:
+            columns[name] = np.zeros(count, np.int64)
+        elif name in FLOAT_COLUMNS:
+            columns[name] = np.zeros(count, np.float32)
+        else:
+            columns[name] = np.zeros(count, np.str_)
+    return columns
+
+
+class ModelIndex:
+    #columnar model metadata, each column is a NumPy array with one entry per file
+    def __init__(self, columns = None):
+        self.columns = columns if columns is not None else emptyColumns()
+        self.errors = []
+
+    def __len__(self):
+        return len(self.columns["path"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @classmethod
+    def fromRows(cls, rows):
+        columns = emptyColumns(len(rows))
+        for name in INDEX_COLUMNS:
+            values = [row[name] for row in rows]
+            if name in STRING_COLUMNS:
+                columns[name] = np.array(values, dtype=np.str_) if values else columns[name]
+            else:
+                columns[name] = np.array(values, dtype=columns[name].dtype)
+        return cls(columns)
+
+    def rows(self):
+        for i in range(len(self)):
+            yield {name: self.columns[name][i].item() for name in INDEX_COLUMNS}
+
+    def select(self, mask):
+        return ModelIndex({name: column[mask] for name, column in self.columns.items()})
+
+    def usesShader(self, shaderID):
+        #mask of the models with a material using shaderID, needs an index built with tables
+        return np.array([shaderID in shaders.split(",") for shaders in self.columns["shaders"]], dtype=bool)
+
+    def usesTexture(self, textureHash):
+        key = f"{textureHash:08x}"
+        return np.array([key in textures.split(",") for textures in self.columns["textures"]], dtype=bool)
+
+    def save(self, path):
+        #the format follows the extension, .npz, .csv or .sqlite/.db
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".npz":
+            np.savez(path, **self.columns)
+        elif ext == ".csv":
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, INDEX_COLUMNS)
+                writer.writeheader()
+                writer.writerows(self.rows())
+        elif ext in (".sqlite", ".db"):
+            if os.path.exists(path):
+                os.remove(path)
+            with sqlite3.connect(path) as db:
+                db.execute(f"CREATE TABLE models ({', '.join(f'{name} {sqlType(name)}' for name in INDEX_COLUMNS)})")
+                db.executemany(f"INSERT INTO models VALUES ({', '.join('?' * len(INDEX_COLUMNS))})",
+                               ([row[name] for name in INDEX_COLUMNS] for row in self.rows()))
+            db.close()
+        else:
+            raise ValueError(f"Unknown index format: {path}")
+
+    @classmethod
+    def load(cls, path):
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".npz":
+            with np.load(path) as data:
+                return cls({name: data[name] for name in INDEX_COLUMNS})
+        elif ext == ".csv":
+            with open(path, newline="", encoding="utf-8") as f:
+                rows = list(csv.DictReader(f))
+            for row in rows:
+                for name in INTEGER_COLUMNS:
+                    row[name] = int(row[name])
+                for name in FLOAT_COLUMNS:
+                    row[name] = float(row[name])
+            return cls.fromRows(rows)
+        elif ext in (".sqlite", ".db"):
+            with sqlite3.connect(path) as db:
+                cursor = db.execute(f"SELECT {', '.join(INDEX_COLUMNS)} FROM models")
+                rows = [dict(zip(INDEX_COLUMNS, values)) for values in cursor]
+            db.close()
+            return cls.fromRows(rows)
+        raise ValueError(f"Unknown index format: {path}")
+
+
+def sqlType(name):
+    if name in INTEGER_COLUMNS:
+        return "INTEGER"
+    if name in FLOAT_COLUMNS:
+        return "REAL"
+    return "TEXT"
+
+
+def modelPaths(paths):
+    #directories are walked for every known model extension, anything else goes through expandPaths
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, files in os.walk(path):
+                found.extend(os.path.join(folder, name) for name in sorted(files)
+                             if os.path.splitext(name)[1].lower().lstrip(".") in MODEL_KINDS)
+        else:
+            found.extend(expandPaths([path]))
+    return found
+
+
+def scanModels(paths, workers = None, kind = None, tables = False, callback = None):
+    #scans many files on a thread pool, files that fail are listed in index.errors as (path, message)
+    paths = modelPaths(paths)
+
+    def scan(path):
+        try:
+            return scanModel(path, kind, tables), None
+        except Exception as e:
+            return None, f"{type(e).__name__}: {e}"
+
+    rows = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for path, (row, error) in zip(paths, pool.map(scan, paths)):
+            if error:
+                errors.append((path, error))
+            else:
+                rows.append(row)
+            if callback:
+                callback(path, row, error)
+
+    index = ModelIndex.fromRows(rows)
+    index.errors = errors
+    return index
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Index TMD/TMD2 model headers.")
+    parser.add_argument("paths", nargs="+", help="folders, files or glob patterns (** is recursive)")
+    parser.add_argument("-o", "--output", required=True, help="index file, .npz, .csv or .sqlite")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("-k", "--kind", choices=sorted(MODEL_KINDS), default=None, help="model type, defaults to the file extension")
+    parser.add_argument("-t", "--tables", action="store_true", help="also read material shaders and texture hashes")
+    args = parser.parse_args(argv)
+
+    index = scanModels(args.paths, args.workers, args.kind, args.tables)
+    for path, error in index.errors:
+        print(f"FAILED {path}: {error}")
+    index.save(args.output)
+    print(f"{len(index)} models indexed, {len(index.errors)} failed")
+    return 1 if index.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
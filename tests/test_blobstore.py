@@ -0,0 +1,62 @@
+import json
+import os
+import stat
+
+import pytest
+
+from tamLib.blobstore import BlobStore, safeJoin, hashBytes
+
+
+@pytest.mark.parametrize("relPath", ["../escaped.bin", "a/../../escaped.bin", "/etc/passwd", "..\\escaped.bin",
+                                     "C:\\Windows\\file.bin", "C:file.bin", "\\\\server\\share\\file.bin", ".", ""])
+def test_safe_join_rejects_unsafe_paths(tmp_path, relPath):
+    with pytest.raises(ValueError):
+        safeJoin(str(tmp_path), relPath)
+
+
+@pytest.mark.parametrize("relPath, expected", [("a.bin", "a.bin"), ("folder/a.bin", os.path.join("folder", "a.bin")),
+                                               ("folder/./b/../a.bin", os.path.join("folder", "a.bin"))])
+def test_safe_join_keeps_paths_inside_root(tmp_path, relPath, expected):
+    assert safeJoin(str(tmp_path), relPath) == os.path.join(str(tmp_path), expected)
+
+
+def test_put_and_put_range_store_each_payload_once(tmp_path):
+    store = BlobStore(str(tmp_path / "store"))
+    source = tmp_path / "source.bin"
+    source.write_bytes(b"header" + b"payload" + b"payload")
+
+    digest = store.put(b"payload")
+    assert digest == hashBytes(b"payload")
+    assert store.putRange(str(source), 6, 7) == digest
+    assert store.putRange(str(source), 13, 7) == digest
+    assert store.get(digest) == b"payload"
+    assert store.stats() == (1, 7)
+
+
+@pytest.mark.parametrize("link", [False, True])
+def test_materialize_never_lets_edits_reach_the_blobs(tmp_path, link):
+    store = BlobStore(str(tmp_path / "store"))
+    digest = store.put(b"shared payload")
+    store.writeManifest("archive", {"a.bin": digest, "folder/b.bin": digest})
+
+    outDir = tmp_path / "out"
+    store.materialize("archive", str(outDir), link)
+    assert (outDir / "folder" / "b.bin").read_bytes() == b"shared payload"
+
+    if link:
+        assert not os.stat(store.blobPath(digest)).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    else:
+        (outDir / "a.bin").write_bytes(b"edited")
+    assert store.get(digest) == b"shared payload"
+
+
+def test_materialize_rejects_unsafe_manifest_paths(tmp_path):
+    store = BlobStore(str(tmp_path / "store"))
+    digest = store.put(b"payload")
+    with open(store.manifestPath("bad"), "w", encoding="utf-8") as f:
+        json.dump({"fine.bin": digest, "../../escaped.bin": digest}, f)
+
+    with pytest.raises(ValueError):
+        store.materialize("bad", str(tmp_path / "out"))
+    assert not (tmp_path / "out").exists()
+    assert not (tmp_path / "escaped.bin").exists()
@@ -0,0 +1,54 @@
+import struct
+
+import pytest
+
+from tamLib.cat import CAT
+from tamLib.utils.PyBinaryReader.binary_reader import BinaryReader
+
+
+def pad(data, alignment = 16):
+    return data + bytes(-len(data) % alignment)
+
+
+def makeSubCAT(leaves, sizes = None):
+    start = len(pad(bytes(20 + 8 * len(leaves))))
+    body = b""
+    offsets = []
+    for leaf in leaves:
+        offsets.append(start + len(body))
+        body = pad(body + leaf)
+    sizes = sizes or [len(leaf) for leaf in leaves]
+    header = struct.pack("<3IQ", 0, len(leaves), 1, 16) + struct.pack(f"<{len(leaves)}I", *offsets) + struct.pack(f"<{len(leaves)}I", *sizes)
+    return pad(header) + body
+
+
+def makeCAT(blocks):
+    count = len(blocks)
+    start = len(pad(bytes(12 + 16 * count)))
+    body = b""
+    offsets = []
+    for block in blocks:
+        offsets.append(start + len(body))
+        body = pad(body + block)
+    header = (struct.pack("<3I", 0, count, 0) + struct.pack(f"<{count}I", *offsets) + struct.pack(f"<{count}I", *[len(block) for block in blocks])
+              + struct.pack(f"<{count}I", *[0] * count) + struct.pack(f"<{count}I", *[1] * count))
+    return pad(header) + body
+
+
+def readCATBytes(data, source = None):
+    return BinaryReader(data).read_struct(CAT, None, "test", 0, source)
+
+
+@pytest.mark.parametrize("useSource", [False, True])
+def test_leaves_are_read_in_place(useSource):
+    data = makeCAT([makeSubCAT([b"first leaf", b"second"]), makeSubCAT([b"third leaf data"])])
+    cat = readCATBytes(data, data if useSource else None)
+    assert [[bytes(leaf) for leaf in subCat.content] for subCat in cat.content] == [[b"first leaf", b"second"], [b"third leaf data"]]
+
+
+@pytest.mark.parametrize("useSource", [False, True])
+def test_leaf_running_past_its_block_is_rejected(useSource):
+    #the first block claims a leaf far larger than the block, it must not read into the next block
+    data = makeCAT([makeSubCAT([b"first leaf"], sizes=[64]), makeSubCAT([b"next block"])])
+    with pytest.raises(ValueError):
+        readCATBytes(data, data if useSource else None)
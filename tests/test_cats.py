@@ -0,0 +1,136 @@
+import io
+import os
+
+import pytest
+
+from tamLib.cats import (CATS, LazyCATS, CATSIndex, loadCATSIndex, writeCATS, readCATS, replaceCATSEntry, addCATSEntry,
+                         removeCATSEntry, compactCATS)
+from tamLib.utils.PyBinaryReader.binary_reader import BinaryReader
+
+
+def makeArchive():
+    inner = CATS()
+    inner.subNames = ["inner.bin"]
+    inner.subData = [b"inner payload"]
+    return [("first.bin", b"first payload"), ("nested", inner), ("last.bin", bytes(range(40)))]
+
+
+def writeArchive(entries):
+    stream = io.BytesIO()
+    writeCATS(stream, entries)
+    return stream.getvalue()
+
+
+def readArchive(data):
+    return BinaryReader(data).read_struct(CATS)
+
+
+def flatten(cats):
+    return [(name, flatten(payload) if isinstance(payload, CATS) else bytes(payload)) for name, payload in cats.entries()]
+
+
+def test_write_read_keeps_entries_in_order():
+    data = writeArchive(makeArchive())
+    cats = readArchive(data)
+    assert flatten(cats) == [("first.bin", b"first payload"), ("nested", [("inner.bin", b"inner payload")]),
+                             ("last.bin", bytes(range(40)))]
+
+    lazy = LazyCATS(data)
+    assert list(lazy) == ["first.bin", "nested", "last.bin"]
+    assert bytes(lazy["nested"]["inner.bin"]) == b"inner payload"
+
+
+def test_edits_to_the_sub_lists_are_written():
+    cats = readArchive(writeArchive(makeArchive()))
+    cats.subData[cats.subNames.index("last.bin")] = b"edited"
+    cats.subCATS[0].subData[0] = b"edited inner"
+    cats.subNames.append("added.bin")
+    cats.subData.append(b"added")
+
+    stream = io.BytesIO()
+    cats.write(stream)
+    assert flatten(readArchive(stream.getvalue())) == [("first.bin", b"first payload"), ("nested", [("inner.bin", b"edited inner")]),
+                                                       ("last.bin", b"edited"), ("added.bin", b"added")]
+
+
+def test_removed_entries_are_not_written():
+    cats = readArchive(writeArchive(makeArchive()))
+    index = cats.subNames.index("first.bin")
+    del cats.subNames[index], cats.subData[index]
+    cats.subCATS.clear()
+
+    stream = io.BytesIO()
+    cats.write(stream)
+    assert flatten(readArchive(stream.getvalue())) == [("last.bin", bytes(range(40)))]
+
+
+def writeArchiveFile(tmp_path):
+    path = str(tmp_path / "archive.cat")
+    with open(path, "wb") as f:
+        f.write(writeArchive(makeArchive()))
+    return path
+
+
+def readFlat(path):
+    return flatten(readCATS(path))
+
+
+@pytest.mark.parametrize("payload", [b"short", bytes(range(256)) * 3])
+def test_replace_entry(tmp_path, payload):
+    #short payloads are written in place, longer ones are appended and every ancestor is grown to cover them
+    path = writeArchiveFile(tmp_path)
+    replaceCATSEntry(path, "nested/inner.bin", payload)
+    replaceCATSEntry(path, "first.bin", payload)
+    assert readFlat(path) == [("first.bin", payload), ("nested", [("inner.bin", payload)]), ("last.bin", bytes(range(40)))]
+    with readCATS(path, lazy=True) as cats:
+        assert bytes(cats["nested"]["inner.bin"]) == payload
+
+
+def test_add_and_remove_entries(tmp_path):
+    path = writeArchiveFile(tmp_path)
+    addCATSEntry(path, "nested", "added.bin", b"added payload")
+    addCATSEntry(path, "", "top.bin", b"top payload")
+    removeCATSEntry(path, "first.bin")
+    assert readFlat(path) == [("nested", [("inner.bin", b"inner payload"), ("added.bin", b"added payload")]),
+                              ("last.bin", bytes(range(40))), ("top.bin", b"top payload")]
+    with pytest.raises(ValueError):
+        addCATSEntry(path, "", "top.bin", b"again")
+    with pytest.raises(KeyError):
+        replaceCATSEntry(path, "nested/missing.bin", b"")
+
+
+def test_compact_drops_dead_space(tmp_path):
+    path = writeArchiveFile(tmp_path)
+    replaceCATSEntry(path, "nested/inner.bin", bytes(1000))
+    replaceCATSEntry(path, "nested/inner.bin", b"small again")
+    removeCATSEntry(path, "last.bin")
+    expected = readFlat(path)
+    grownSize = os.path.getsize(path)
+
+    outPath = str(tmp_path / "compact.cat")
+    compactCATS(path, outPath)
+    assert readFlat(outPath) == expected
+    assert os.path.getsize(outPath) < grownSize
+
+    compactCATS(path)
+    assert readFlat(path) == expected
+    assert os.path.getsize(path) == os.path.getsize(outPath)
+
+
+def test_index_lookup_and_sidecar(tmp_path):
+    path = writeArchiveFile(tmp_path)
+    index = loadCATSIndex(path)
+    assert sorted(index.entries) == ["first.bin", "last.bin", "nested", "nested/inner.bin"]
+    assert index["nested"][2] and not index["nested/inner.bin"][2]
+    with open(path, "rb") as f:
+        assert index.read(f, "nested/inner.bin") == b"inner payload"
+
+    #an unchanged archive reuses the sidecar, an edited one is indexed again
+    assert CATSIndex.load(path + ".idx").entries == index.entries
+    assert loadCATSIndex(path).entries == index.entries
+    replaceCATSEntry(path, "nested/inner.bin", bytes(500))
+    os.utime(path, ns=(0, index.mtime + 1))
+    rebuilt = loadCATSIndex(path)
+    assert rebuilt["nested/inner.bin"][1] == 500
+    with open(path, "rb") as f:
+        assert rebuilt.read(f, "nested/inner.bin") == bytes(500)
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from tamLib.cats import CATS, writeCATS
+from tamLib.extract import extractArchive
+
+
+def writeArchive(path, entries):
+    writeCATS(str(path), entries)
+    return str(path)
+
+
+def test_extracts_into_a_folder_named_after_the_archive(tmp_path):
+    inner = CATS()
+    inner.subNames = ["inner.dds"]
+    inner.subData = [b"DDS inner"]
+    path = writeArchive(tmp_path / "archive.cat", [("a.bin", b"payload a"), ("nested", inner), ("model", b"tmd0 data")])
+    (tmp_path / "a.bin").write_bytes(b"sibling")
+
+    extracted = extractArchive(path, workers=2)
+
+    outDir = tmp_path / "archive"
+    assert sorted(os.path.relpath(p, outDir) for p in extracted) == sorted(["a.bin", os.path.join("nested", "inner.dds"), "model.tmd"])
+    assert (outDir / "a.bin").read_bytes() == b"payload a"
+    assert (outDir / "nested" / "inner.dds").read_bytes() == b"DDS inner"
+    assert (outDir / "model.tmd").read_bytes() == b"tmd0 data"
+    assert (tmp_path / "a.bin").read_bytes() == b"sibling"
+
+
+def test_entry_named_like_the_archive_is_refused(tmp_path):
+    path = writeArchive(tmp_path / "archive.cat", [("archive.cat", b"would truncate the archive")])
+    before = open(path, "rb").read()
+
+    with pytest.raises(ValueError):
+        extractArchive(path, str(tmp_path))
+    assert open(path, "rb").read() == before
+
+
+def test_entry_escaping_the_output_folder_is_refused(tmp_path):
+    path = writeArchive(tmp_path / "archive.cat", [("../../escaped.bin", b"payload")])
+
+    with pytest.raises(ValueError):
+        extractArchive(path)
+    assert not (tmp_path / "archive").exists()
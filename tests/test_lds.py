@@ -0,0 +1,35 @@
+from tamLib.blobstore import BlobStore
+from tamLib.cats import writeCATS
+from tamLib.extract import extractArchive
+from tamLib.lds import LDS, unpackLDS
+from tamLib.utils.PyBinaryReader.binary_reader import BinaryReader
+
+
+def writeLDS(path, textures):
+    lds = LDS()
+    lds.textures = textures
+    br = BinaryReader()
+    br.write_struct(lds)
+    path.write_bytes(bytes(br.buffer()))
+    return str(path)
+
+
+def test_unpack_writes_every_texture(tmp_path):
+    path = writeLDS(tmp_path / "model.lds", [b"DDS first", b"DDS second"])
+    paths = unpackLDS(path)
+    assert [open(p, "rb").read() for p in paths] == [b"DDS first", b"DDS second"]
+    assert all(p.startswith(str(tmp_path / "model")) and p.endswith(".dds") for p in paths)
+
+
+def test_lds_and_archive_with_the_same_stem_keep_their_manifests(tmp_path):
+    store = BlobStore(str(tmp_path / "store"))
+    ldsPath = writeLDS(tmp_path / "model.lds", [b"DDS texture"])
+    catPath = str(tmp_path / "model.cat")
+    writeCATS(catPath, [("mesh.bin", b"mesh payload")])
+
+    ldsManifest = unpackLDS(ldsPath, store=store)
+    catManifest = extractArchive(catPath, store=store)
+
+    assert store.readManifest("model.lds") == ldsManifest
+    assert store.readManifest("model") == catManifest
+    assert store.get(ldsManifest["model_000.dds"]) == b"DDS texture"
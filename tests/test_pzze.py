@@ -0,0 +1,77 @@
+import io
+import os
+import zlib
+
+import numpy as np
+import pytest
+
+from tamLib.pzze import compressPZZE, decompressPZZE, parallelCompress, readPZZE, batchPZZE
+
+
+def makeData(size = 300000, seed = 0):
+    #half random, half repeated, so the parallel blocks get both matches across boundaries and literals
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 256, size // 2, dtype=np.uint8).tobytes()
+    return noise + (b"tmd0 pattern " * (size // 26 + 1))[: size - len(noise)]
+
+
+def roundTrip(data, **kwargs):
+    compressed = io.BytesIO()
+    assert compressPZZE(io.BytesIO(data), compressed, "tmd2", **kwargs) == len(data)
+    compressed.seek(0)
+    out = io.BytesIO()
+    header = decompressPZZE(compressed, out)
+    return compressed.getvalue(), header, out.getvalue()
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"chunkSize": 4096}, {"blockSize": 1 << 15, "workers": 4}])
+def test_compress_decompress_round_trip(kwargs):
+    data = makeData()
+    compressed, header, out = roundTrip(data, **kwargs)
+    assert out == data
+    assert header.fileFormat == "tmd2"
+    assert header.decompressedSize == len(data)
+
+
+def test_parallel_stream_is_a_single_zlib_stream():
+    data = makeData(1 << 18, seed=1)
+    assert zlib.decompress(parallelCompress(data, blockSize=1 << 14, workers=4)) == data
+    assert zlib.decompress(parallelCompress(b"", blockSize=1 << 14)) == b""
+
+
+def test_pzze_file_reader_matches_the_stream(tmp_path):
+    data = makeData(50000)
+    path = tmp_path / "model.tmd2"
+    with open(path, "wb") as f:
+        compressPZZE(io.BytesIO(data), f, "tmd2", blockSize=1 << 14)
+    assert readPZZE(str(path)).decompress() == data
+
+
+def test_truncated_stream_raises():
+    compressed, header, out = roundTrip(makeData(20000))
+    with pytest.raises((ValueError, zlib.error)):
+        decompressPZZE(io.BytesIO(compressed[:-20]), io.BytesIO())
+
+
+def test_batch_compress_then_decompress(tmp_path):
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    files = {"a.tmd2": makeData(40000, 2), os.path.join("sub", "b.tmd2"): makeData(70000, 3)}
+    for name, data in files.items():
+        (src / name).write_bytes(data)
+
+    packed = batchPZZE([str(src / "**" / "*.tmd2")], str(tmp_path / "packed"), "compress", workers=2, root=str(src), blockSize=1 << 14)
+    assert all(result.error is None for result in packed)
+    unpacked = batchPZZE([result.outPath for result in packed], str(tmp_path / "unpacked"), "decompress", workers=2,
+                         root=str(tmp_path / "packed"))
+    assert all(result.error is None for result in unpacked)
+    for name, data in files.items():
+        assert (tmp_path / "unpacked" / name).read_bytes() == data
+
+
+def test_batch_reports_failures_without_output(tmp_path):
+    bad = tmp_path / "bad.tmd2"
+    bad.write_bytes(b"not a pzze file at all")
+    result, = batchPZZE([str(bad)], str(tmp_path / "out"), "decompress")
+    assert result.error is not None
+    assert not os.path.exists(result.outPath)
@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+import pytest
+
+from tamLib.pzze import compressPZZE
+from tamLib.scan import ModelIndex, scanModel, scanModels, INDEX_COLUMNS
+from tamLib.tmd2 import readTMD2
+
+from test_tmd_roundtrip import makeModel as makeTMD, writeModel as writeTMD
+from test_tmd2cache import writeModel as writeTMD2
+
+
+@pytest.fixture
+def models(tmp_path):
+    folder = tmp_path / "models"
+    (folder / "sub").mkdir(parents=True)
+    writeTMD2(folder / "plain.tmd2")
+    compressPZZE(writeTMD2(tmp_path / "raw.tmd2", seed=1), str(folder / "sub" / "packed.tmd2"), "tmd2")
+    (folder / "old.tmd").write_bytes(writeTMD(makeTMD()))
+    (folder / "broken.tmd2").write_bytes(b"not a model")
+    (folder / "notes.txt").write_bytes(b"ignored")
+    return folder
+
+
+def test_scan_matches_the_full_reader(models):
+    row = scanModel(str(models / "plain.tmd2"), tables=True)
+    tmd = readTMD2(str(models / "plain.tmd2"))
+    for name in ("version", "modelFlags", "vertexCount", "trianglesCount", "subMeshCount", "modelCount", "materialCount",
+                 "textureCount", "boneCount", "verticesOffset", "trianglesOffset"):
+        assert row[name] == getattr(tmd, name)
+    assert row["shaders"] == "sh00"
+    assert row["textures"] == "00000064"
+
+    packed = scanModel(str(models / "sub" / "packed.tmd2"), tables=True)
+    assert packed["vertexCount"] == row["vertexCount"] and packed["shaders"] == "sh00"
+
+
+def test_scan_folder_collects_rows_and_errors(models):
+    index = scanModels([str(models)], workers=2, tables=True)
+    assert sorted(os.path.basename(path) for path in index["path"]) == ["old.tmd", "packed.tmd2", "plain.tmd2"]
+    assert [os.path.basename(path) for path, error in index.errors] == ["broken.tmd2"]
+    assert sorted(index["kind"].tolist()) == ["tmd", "tmd2", "tmd2"]
+    assert index.usesShader("sh00").all()
+    assert not index.usesShader("missing").any()
+    assert len(index.select(index["kind"] == "tmd")) == 1
+
+
+@pytest.mark.parametrize("ext", [".npz", ".csv", ".sqlite"])
+def test_index_save_load_round_trip(models, tmp_path, ext):
+    index = scanModels([str(models)], tables=True)
+    path = str(tmp_path / f"index{ext}")
+    index.save(path)
+    loaded = ModelIndex.load(path)
+    assert len(loaded) == len(index)
+    for name in INDEX_COLUMNS:
+        assert np.array_equal(loaded[name], index[name]), name
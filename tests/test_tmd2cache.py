@@ -0,0 +1,154 @@
+import os
+
+import numpy as np
+import pytest
+
+from tamLib.pzze import compressPZZE
+from tamLib.tmd2 import TMD2, TMD2Texture, TMD2Material, TMD2MatTexture, TMD2Bone, TMD2Model, TMD2Submesh, TMD2Vertex, TMD2BoundingBox, readTMD2
+from tamLib.tmd2cache import TMD2Cache
+
+
+def makeModel(seed = 0):
+    rng = np.random.default_rng(seed)
+    tmd = TMD2()
+    tmd.flag1 = tmd.flag2 = tmd.animFlag = tmd.afterImageValue = 0
+    tmd.modelFlags = 0x2 | 0x4 | 0x10 | 0x80 | 0x400 | 0x2000
+    tmd.boundingBox = [0, 0, 0, 1, 1, 1]
+
+    texture = TMD2Texture()
+    texture.hash = 100
+    tmd.textures = [texture]
+
+    material = TMD2Material()
+    material.hash = 500
+    material.shaderID = "sh00"
+    matTexture = TMD2MatTexture()
+    matTexture.texture = texture
+    matTexture.slot = 1
+    material.textures = [matTexture]
+    material.shaderParams = [0.5, 1.0]
+    tmd.materials = [material]
+
+    tmd.bones = []
+    for i in range(3):
+        bone = TMD2Bone()
+        bone.hash = 1000 + i
+        bone.name = f"bone{i}"
+        bone.parentIndex = i - 1
+        bone.matrix = np.eye(4, dtype=np.float32) * (i + 1)
+        bone.extra = 0 if i == 1 else -1
+        bone.offset = [0.1, 0.2, 0.3]
+        tmd.bones.append(bone)
+
+    model = TMD2Model()
+    model.name = "body"
+    model.hash = 77
+    model.meshes = []
+    for count in (5, 4):
+        mesh = TMD2Submesh()
+        mesh.material = material
+        mesh.indexTable = [0, 1, 2]
+        mesh.vertices = []
+        for _ in range(count):
+            vertex = TMD2Vertex()
+            vertex.position = rng.random(3).tolist()
+            normal = rng.random(3) - 0.5
+            vertex.normal = (normal / np.linalg.norm(normal)).tolist()
+            vertex.uv = rng.random(2).tolist()
+            vertex.color = rng.random(4).tolist()
+            weights = rng.random(4)
+            vertex.boneWeights = (weights / weights.sum()).tolist()
+            vertex.boneIDs = rng.integers(0, 3, 4).tolist()
+            mesh.vertices.append(vertex)
+        mesh.triangles = [[0, 1, 2], [2, 3, 1]] + ([[1, 4, 0]] if count > 4 else [])
+        model.meshes.append(mesh)
+    tmd.models = [model]
+
+    tmd.BBoxCorners = []
+    for i in range(2):
+        corners = TMD2BoundingBox()
+        corners.corners = [[float(i), 1.0, 2.0]] * 8
+        tmd.BBoxCorners.append(corners)
+    return tmd
+
+
+def writeModel(path, seed = 0):
+    makeModel(seed).write(str(path))
+    return str(path)
+
+
+def summary(tmd):
+    return {
+        "vertices": tmd.rawVertices.tobytes(),
+        "triangles": tmd.triangles.tolist(),
+        "submeshes": [(mesh.vertexIndices.tolist(), mesh.triangles.tolist(), mesh.material.hash) for mesh in tmd.submeshes],
+        "bones": [(bone.name, bone.hash, bone.parentIndex, np.asarray(bone.matrix).tolist(), bone.extra) for bone in tmd.bones],
+        "models": [(model.name, model.hash, len(model.meshes)) for model in tmd.models],
+        "materials": [(material.hash, material.shaderID) for material in tmd.materials],
+    }
+
+
+@pytest.mark.parametrize("keyMode", ["stat", "content"])
+def test_store_then_hit(tmp_path, keyMode):
+    path = writeModel(tmp_path / "model.tmd2")
+    cache = TMD2Cache(str(tmp_path / "cache"), keyMode=keyMode)
+    expected = summary(readTMD2(path))
+
+    missed = cache.load(path)
+    assert summary(missed) == expected
+    assert len(cache.entries()) == 1
+
+    hit = cache.load(path)
+    assert summary(hit) == expected
+    #a hit takes the decoded arrays from the entry instead of decoding them again
+    assert isinstance(hit.boneData, np.memmap)
+    assert isinstance(hit.submeshVertexIndices, np.memmap)
+
+    lazy = cache.load(path, lazy=True)
+    assert "models" not in lazy.__dict__
+    assert summary(lazy) == expected
+    assert len(cache.entries()) == 1
+
+
+def test_compressed_files_are_cached_decompressed(tmp_path):
+    raw = writeModel(tmp_path / "raw.tmd2")
+    path = str(tmp_path / "model.tmd2")
+    compressPZZE(raw, path, "tmd2")
+    cache = TMD2Cache(str(tmp_path / "cache"))
+
+    assert summary(cache.load(path)) == summary(readTMD2(raw))
+    assert summary(cache.load(path)) == summary(readTMD2(raw))
+    (key, size, lastUse), = cache.entries()
+    with open(os.path.join(cache.entryPath(key), "model.tmd0"), "rb") as f:
+        assert f.read(4) == b"tmd0"
+
+
+def test_stale_and_damaged_entries_are_rebuilt(tmp_path):
+    path = writeModel(tmp_path / "model.tmd2")
+    cache = TMD2Cache(str(tmp_path / "cache"))
+    cache.load(path)
+
+    (key, size, lastUse), = cache.entries()
+    with open(os.path.join(cache.entryPath(key), "model.tmd0"), "r+b") as f:
+        f.write(b"bad!")
+    assert summary(cache.load(path)) == summary(readTMD2(path))
+
+    writeModel(path, seed=1)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    assert summary(cache.load(path)) == summary(readTMD2(path))
+    assert len(cache.entries()) == 2
+
+
+def test_evict_keeps_the_cache_under_max_size(tmp_path):
+    cache = TMD2Cache(str(tmp_path / "cache"))
+    paths = [writeModel(tmp_path / f"model{i}.tmd2", seed=i) for i in range(3)]
+    for i, path in enumerate(paths):
+        cache.load(path)
+        os.utime(os.path.join(cache.entryPath(cache.statKey(path)), "meta.json"), (i, i))
+
+    entrySize = max(size for _, size, _ in cache.entries())
+    removed = cache.evict(entrySize * 2)
+    assert removed == [cache.statKey(paths[0])]
+    assert cache.size() <= entrySize * 2
+    cache.clear()
+    assert cache.entries() == []
@@ -0,0 +1,98 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from tamLib.tmd import TMD, TMDTexture, TMDMaterial, TMDMatTexture, TMDBone, TMDModel, TMDSubmesh, TMDVertex
+from tamLib.utils.PyBinaryReader.binary_reader import BinaryReader
+
+
+def makeModel(seed = 0):
+    rng = np.random.default_rng(seed)
+    tmd = TMD()
+    tmd.animFlag = 0
+    tmd.modelFlags = 0x2 | 0x4 | 0x10 | 0x80 | 0x400 | 0x2000
+    tmd.boundingBox = [0, 0, 0, 1, 1, 1]
+
+    texture = TMDTexture()
+    texture.hash = 100
+    tmd.textures = [texture]
+
+    material = TMDMaterial()
+    material.hash = 500
+    material.shaderID = "sh00"
+    matTexture = TMDMatTexture()
+    matTexture.texture = texture
+    matTexture.slot = 1
+    material.textures = [matTexture]
+    material.shaderParams = [0.5, 1.0]
+    tmd.materials = [material]
+
+    tmd.bones = []
+    for i in range(3):
+        bone = TMDBone()
+        bone.hash = 1000 + i
+        bone.name = f"bone{i}"
+        bone.parentIndex = i - 1
+        bone.matrix = np.eye(4, dtype=np.float32) * (i + 1)
+        tmd.bones.append(bone)
+
+    model = TMDModel()
+    model.name = "body"
+    model.hash = 77
+    model.unk1 = model.unk2 = model.unk3 = 0
+    model.meshes = []
+    for count in (5, 4):
+        mesh = TMDSubmesh()
+        mesh.material = material
+        mesh.indexTable = [0, 1, 2]
+        mesh.vertices = []
+        for _ in range(count):
+            vertex = TMDVertex()
+            vertex.position = rng.random(3).tolist()
+            normal = rng.random(3) - 0.5
+            vertex.normal = (normal / np.linalg.norm(normal)).tolist()
+            vertex.uv = rng.random(2).tolist()
+            vertex.color = rng.random(4).tolist()
+            weights = rng.random(4)
+            vertex.boneWeights = (weights / weights.sum()).tolist()
+            vertex.boneIDs = rng.integers(0, 3, 4).tolist()
+            mesh.vertices.append(vertex)
+        mesh.triangles = [[0, 1, 2], [2, 3, 1]] + ([[1, 4, 0]] if count > 4 else [])
+        model.meshes.append(mesh)
+    tmd.models = [model]
+    return tmd
+
+
+def writeModel(tmd):
+    br = BinaryReader()
+    with contextlib.redirect_stdout(io.StringIO()):
+        br.write_struct(tmd)
+    return bytes(br.buffer())
+
+
+def readModel(data, vertexObjects = False):
+    return BinaryReader(data).read_struct(TMD, None, "test", {}, vertexObjects)
+
+
+def submeshGeometry(tmd):
+    return [(tmd.rawVertices[mesh.vertexIndices].tobytes(), np.asarray(mesh.triangles).tolist()) for mesh in tmd.submeshes]
+
+
+@pytest.mark.parametrize("vertexObjects", [False, True])
+def test_read_write_read_keeps_geometry(vertexObjects):
+    data = writeModel(makeModel())
+    first = readModel(data, vertexObjects)
+    second = readModel(writeModel(first))
+
+    assert second.vertexCount == first.vertexCount > 0
+    assert second.trianglesCount == first.trianglesCount > 0
+    assert submeshGeometry(second) == submeshGeometry(first)
+
+
+def test_submesh_without_vertices_is_rejected():
+    tmd = makeModel()
+    tmd.models[0].meshes[0].vertices = []
+    with pytest.raises(ValueError):
+        writeModel(tmd)
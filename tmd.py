@@ -1,8 +1,9 @@
 from .utils.PyBinaryReader.binary_reader import *
 from .pzze import readPZZE
+from .meshops import buildSubmeshCSR, VertexBuffer, BONE_DTYPE, boneMatrixBytes
+from .vertexlayout import VertexLayout, VERTEX_CONVERTERS
 import numpy as np
 from itertools import chain
-import struct
 
 class TMD(BrStruct):
 
@@ -11,6 +12,8 @@ class TMD(BrStruct):
         self.name = ""
         self.version = 0x201
         self.modelFlags = 0
+        #skin weight rounding used by the writer, "round" or "largest" (see meshops.quantizeWeights8)
+        self.weightQuantization = "round"
         
         self.bones = []
         self.models = []
@@ -18,15 +21,125 @@ class TMD(BrStruct):
         self.textures = []
         
         self.unkBoneInfo = []
+        self.boneData = np.zeros(0, BONE_DTYPE)
+        self.boneMatrices = np.zeros((0, 4, 4), np.float32)
         
-    def __br_read__(self, br: 'BinaryReader', file_name = "", texture_names = {}) -> None:
+    def __br_read__(self, br: 'BinaryReader', file_name = "", texture_names = {}, vertexObjects = False, precision = None) -> None:
+        #vertices is a TMDVertexBuffer, vertexObjects gives the model and its submeshes TMDVertex lists instead
+        if file_name:
+            self.name = file_name
+        
+        self.readHeader(br)
+        self.readMaterials(br, texture_names)
+        
+        # Read vertex buffer, attributes are converted on access
+        br.seek(self.verticesOffset, Whence.BEGIN)
+        npVertexAtt = VertexLayout("tmd", self.modelFlags).readDtype
+        self.rawVertices = br.read_structured_array(npVertexAtt, self.vertexCount)
+        self.vertices = TMDVertexBuffer(self.rawVertices, precision)
+
+        # Read triangle info
+        br.seek(self.trianglesOffset, Whence.BEGIN)
+        dtype = np.uint32 if self.modelFlags & 0x800 else np.uint16
+        tribuffer = br.read_bytes(self.trianglesCount * 3 * np.dtype(dtype).itemsize)
+        self.triangles = np.frombuffer(tribuffer, dtype=dtype).reshape(-1, 3)
+
 
+        if self.modelFlags & 0x2000:
+            #read all indices for the index table
+            br.seek(self.tableIndicesOffset, Whence.BEGIN)
+            self.allIndices = np.frombuffer(br.read_bytes(self.tableIndicesCount), dtype=np.uint8)
+            
+            #pass the indices list to the index table class and read the individual index tables
+            br.seek(self.indexTablesOffset, Whence.BEGIN)
+            self.indexTables = br.read_struct(TMDIndexTable, self.indexTablesCount, self.allIndices)
+            
+            if not self.indexTables:
+                genericIndexTable = TMDIndexTable()
+                genericIndexTable.indices = [i for i in range(self.boneCount)]
+                self.indexTables = [genericIndexTable]
+            
+            #the skeleton is read as whole arrays, bones are thin wrappers with views into them
+            br.seek(self.boneHierarchyOffset, Whence.BEGIN)
+            self.boneData = np.array(br.read_structured_array(BONE_DTYPE, self.boneCount))
+            
+            #read the matrix info
+            br.seek(self.boneMatrixOffset, Whence.BEGIN)
+            self.boneMatrices = np.array(br.read_structured_array(np.dtype('<f4'), self.boneCount * 16)).reshape(-1, 4, 4)
+            
+            hashes = self.boneData['hash'].tolist()
+            parents = self.boneData['parentIndex'].tolist()
+            unks = self.boneData['unk1'].tolist()
+            nameOffsets = self.boneData['nameOffset'].tolist()
+            self.bones = []
+            for i in range(self.boneCount):
+                bone = TMDBone()
+                bone.hash = hashes[i]
+                bone.posedLocation = self.boneData['posedLocation'][i]
+                bone.parentIndex = parents[i]
+                bone.unk1 = unks[i]
+                bone.nameOffset = nameOffsets[i]
+                bone.name = str(bone.hash)
+                bone.matrix = self.boneMatrices[i]
+                self.bones.append(bone)
+            
+            #print(self.bones[0].__dict__)
+        
+        br.seek(self.subMeshEntriesOffset, Whence.BEGIN)
+        self.submeshEntries = br.read_struct(TMDSubmeshEntry,self.subMeshEntriesCount)
+        
+        br.seek(self.subMeshOffset, Whence.BEGIN)
+        self.submeshes = br.read_struct(TMDSubmesh,self.subMeshCount)
+        
+        #vertex sets and local triangles of all submeshes are built at once, each submesh gets views into them
+        (self.submeshVertexIndices, self.submeshVertexOffsets,
+         self.submeshTriangles, self.submeshTriangleOffsets) = buildSubmeshCSR(
+            self.triangles, [m.trianglesStart for m in self.submeshes], [m.trianglesCount for m in self.submeshes])
+        
+        vertexOffsets, triangleOffsets = self.submeshVertexOffsets, self.submeshTriangleOffsets
+        for i, mesh in enumerate(self.submeshes):
+            mesh.vertexIndices = self.submeshVertexIndices[vertexOffsets[i]: vertexOffsets[i + 1]]
+            mesh.triangles = self.submeshTriangles[triangleOffsets[i]: triangleOffsets[i + 1]]
+        
+        if vertexObjects:
+            self.vertices = self.vertexObjects()
+            for mesh in self.submeshes:
+                mesh.vertices = [self.vertices[i] for i in mesh.vertexIndices.tolist()]
+        
+        #read model info
+        br.seek(self.modelsOffset, Whence.BEGIN)
+        self.models = br.read_struct(TMDModel, self.modelCount, self.indexTables, self.submeshEntries, self.submeshes, self.materials, self.namesOffset)
+                
+        
+    def submeshVertices(self, mesh, index = 0):
+        #vertices written for a submesh, meshes read without vertexObjects use their rows of the raw vertex buffer
+        if len(mesh.vertices) or not len(mesh.triangles):
+            return mesh.vertices
+        vertexIndices = getattr(mesh, "vertexIndices", None)
+        rawVertices = getattr(self, "rawVertices", None)
+        if vertexIndices is None or rawVertices is None:
+            raise ValueError(f"Submesh {index} has triangles but no vertices")
+        return rawVertices[vertexIndices]
+    
+    def vertexObjects(self, indices = None):
+        #TMDVertex objects for the given vertex indices (all when None), built from the vertex buffer
+        vertices = self.vertices if isinstance(self.vertices, VertexBuffer) else TMDVertexBuffer(self.rawVertices)
+        if indices is None:
+            indices = slice(None)
+        
+        columns = {name: vertices.decode(name, indices).tolist() for name in vertices.names}
+        objects = []
+        for i in range(len(vertices.raw[indices])):
+            vertex = TMDVertex()
+            for name, column in columns.items():
+                setattr(vertex, name, column[i])
+            objects.append(vertex)
+        return objects
+    
+    def readHeader(self, br: 'BinaryReader') -> None:
         self.magic = br.read_str(4)
         if self.magic != 'tmd0':
             raise ValueError(f"Invalid magic: {self.magic}")
-
-        if file_name:
-            self.name = file_name
         
         unk0 = br.read_uint16()
         self.modelFlags = br.read_uint16()
@@ -74,8 +187,8 @@ class TMD(BrStruct):
             self.tableIndicesCount = br.read_uint32()
             self.boneCount = br.read_uint32()
             self.totalBoneCount = br.read_uint32()
-
-        
+    
+    def readMaterials(self, br: 'BinaryReader', texture_names = {}) -> None:
         #Textures Info
         br.seek(self.texturesOffset, Whence.BEGIN)
         self.textures = br.read_struct(TMDTexture, self.textureCount, texture_names)
@@ -91,133 +204,7 @@ class TMD(BrStruct):
         #Material Info
         br.seek(self.materialsOffset, Whence.BEGIN)
         self.materials = br.read_struct(TMDMaterial, self.materialCount, self.materialTextures, self.shaderParams)
-
-        
-        def unpack_normals(v):
-            # Strip 4th component and normalize XYZ
-            f = ((v[..., :3].astype(np.float32) / 255.0) * 2.0) - 1.0
-            norm = np.linalg.norm(f, axis=-1, keepdims=True)
-            norm[norm == 0] = 1.0
-            return f / norm
-        
-        # Define converters for specific attributes
-        _attribute_converters = {
-            'normal':      unpack_normals,
-            'normal2':     unpack_normals,
-            'tangent':     unpack_normals,
-            'binormal':    unpack_normals,
-            'color':       lambda v: v.astype(np.float32) / 255.0,
-            'color2':      lambda v: v.astype(np.float32) / 255.0,
-            'boneWeights': lambda v: v.astype(np.float32) / 255.0,
-            'boneWeights2':lambda v: v.astype(np.float32) / 255.0,
-            'uv':lambda v: v.astype(np.float32) / 1024.0,
-            'uv2':lambda v: v.astype(np.float32) / 1024.0,
-            'uv3':lambda v: v.astype(np.float32) / 1024.0,
-        }
-
-        # Determine vertex attributes based on flags
-        vertex_attributes = []
-        if self.modelFlags & 0x2:
-            vertex_attributes.append(('position', 'f4', 3))
-
-        if self.modelFlags & 0x400:
-            vertex_attributes.append(('boneWeights', 'u1', 4))
-            vertex_attributes.append(('boneIDs', 'u1', 4))
-
-        if self.modelFlags & 0x8000:
-            vertex_attributes.append(('boneWeights2', 'u1', 4))
-            vertex_attributes.append(('boneIDs2', 'u1', 4))
-
-        if self.modelFlags & 0x4:
-            vertex_attributes.append(('normal', 'u1', 4))
-
-        if self.modelFlags & 0x8:
-            vertex_attributes.append(('tangent', 'u1', 4))
-            vertex_attributes.append(('binormal', 'u1', 4))
-
-        if self.modelFlags & 0x80:
-            vertex_attributes.append(('color', 'u1', 4))
-
-        if self.modelFlags & 0x100:
-            vertex_attributes.append(('normal2', 'u1', 4))
-
-        if self.modelFlags & 0x200:
-            vertex_attributes.append(('color2', 'u1', 4))
-
-        if self.modelFlags & 0x10:
-            vertex_attributes.append(('uv', 'u2', 2))
-        if self.modelFlags & 0x20:
-            vertex_attributes.append(('uv2', 'u2', 2))
-        if self.modelFlags & 0x40:
-            vertex_attributes.append(('uv3', 'u2', 2))
-
-        # Read vertex buffer
-        br.seek(self.verticesOffset, Whence.BEGIN)
-        npVertexAtt = np.dtype(vertex_attributes)
-        self.rawVertices = br.read_structured_array(npVertexAtt, self.vertexCount)
-
-        
-        # Convert fields in bulk
-        converted_attributes = {}
-        for name, dtype, size in vertex_attributes:
-            column = self.rawVertices[name]
-            if name in _attribute_converters:
-                column = _attribute_converters[name](column)
-            converted_attributes[name] = column
-
-        # Create and fill vertex objects
-        self.vertices = [TMDVertex() for _ in range(self.vertexCount)]
-        for i in range(self.vertexCount):
-            vertex = self.vertices[i]
-            for name in converted_attributes:
-                setattr(vertex, name, list(converted_attributes[name][i]))
-
-        #print(self.vertices[0].__dict__)
-
-        # Read triangle info
-        br.seek(self.trianglesOffset, Whence.BEGIN)
-        if self.modelFlags & 0x800:
-            self.triangles = [br.read_uint32(3) for _ in range(self.trianglesCount)]
-        else:
-            self.triangles = [br.read_uint16(3) for _ in range(self.trianglesCount)]
-
-
-        if self.modelFlags & 0x2000:
-            #read all indices for the index table
-            br.seek(self.tableIndicesOffset, Whence.BEGIN)
-            self.allIndices = [br.read_uint8() for i in range(self.tableIndicesCount)]
-            
-            #pass the indices list to the index table class and read the individual index tables
-            br.seek(self.indexTablesOffset, Whence.BEGIN)
-            self.indexTables = br.read_struct(TMDIndexTable, self.indexTablesCount, self.allIndices)
-            
-            if not self.indexTables:
-                genericIndexTable = TMDIndexTable()
-                genericIndexTable.indices = [i for i in range(self.boneCount)]
-                self.indexTables = [genericIndexTable]
-            
-            # read skeleton info
-            br.seek(self.boneHierarchyOffset, Whence.BEGIN)
-            self.bones = br.read_struct(TMDBone, self.boneCount, self.namesOffset)
-            
-            #read the matrix info
-            br.seek(self.boneMatrixOffset, Whence.BEGIN)
-            for i in range(self.boneCount):
-                self.bones[i].matrix = [br.read_float32(4) for _ in range(4)]
-            
-            #print(self.bones[0].__dict__)
-        
-        br.seek(self.subMeshEntriesOffset, Whence.BEGIN)
-        self.submeshEntries = br.read_struct(TMDSubmeshEntry,self.subMeshEntriesCount)
-        
-        br.seek(self.subMeshOffset, Whence.BEGIN)
-        self.submeshes = br.read_struct(TMDSubmesh,self.subMeshCount, self.triangles, self.vertices)
-        
-        #read model info
-        br.seek(self.modelsOffset, Whence.BEGIN)
-        self.models = br.read_struct(TMDModel, self.modelCount, self.indexTables, self.submeshEntries, self.submeshes, self.materials, self.namesOffset)
-                
-        
+    
     def __br_write__(self, br: 'BinaryReader', *args) -> None:
         #magic
         br.write_str_fixed("tmd0",4)
@@ -381,93 +368,21 @@ class TMD(BrStruct):
         triangleOffsets = []
         
         submeshBuffer = BinaryReader()
-        submeshBuffer.write_struct(submeshes, trianglesList, verticesList, triangleOffsets)
+        for i, submesh in enumerate(submeshes):
+            submeshBuffer.write_struct(submesh, trianglesList, verticesList, triangleOffsets, self.submeshVertices(submesh, i))
         print("submeshes Written")
         
-        def encode_weights_8(total_weights):
-            scaled = [int(round(w * 255)) for w in total_weights]
-            diff = 255 - sum(scaled)
-            if diff != 0:
-                # Distribute diff to the largest weight
-                max_idx = max(range(len(scaled)), key=lambda i: scaled[i])
-                scaled[max_idx] = min(255, max(0, scaled[max_idx] + diff))
-            return scaled[:4], scaled[4:]
-        
         #write the vertex buffer
         vertexBuffer = BinaryReader()
-        vertex_format = ''
-        field_generators = []
-        flags = self.modelFlags
-        if flags & 0x2:  # position
-            vertex_format += '3f'
-            field_generators.append(lambda v: v.position)
-
-        
-        if flags & 0x400:  # bone weights + IDs
-            vertex_format += '4B4B'
-            field_generators.append(lambda v: encode_weights_8(v.boneWeights + v.boneWeights2)[0])  # boneWeights
-            field_generators.append(lambda v: v.boneIDs)
-
-        if flags & 0x8000:  # bone weights2 + IDs2
-            vertex_format += '4B4B'
-            field_generators.append(lambda v: encode_weights_8(v.boneWeights + v.boneWeights2)[1])  # boneWeights2
-            field_generators.append(lambda v: v.boneIDs2)
-
-        if flags & 0x4:  # normal
-            vertex_format += '3B B'
-            field_generators.append(lambda v: [int((n * 0.5 + 0.5) * 255 + 0.5) for n in v.normal])
-            field_generators.append(lambda v: [255])
-
-        if flags & 0x8:  # tangent + binormal
-            vertex_format += '3B B 3B B'
-            field_generators.append(lambda v: [int((f * 0.5 + 0.5) * 255 + 0.5) for f in v.tangent])
-            field_generators.append(lambda v: [0])
-            field_generators.append(lambda v: [int((f * 0.5 + 0.5) * 255 + 0.5) for f in v.binormal])
-            field_generators.append(lambda v: [0])
-
-        if flags & 0x80:  # color
-            vertex_format += '4B'
-            field_generators.append(lambda v: [int(c * 255) for c in v.color])
-
-        if flags & 0x100:  # normal2
-            vertex_format += '3B B'
-            field_generators.append(lambda v: [int((n * 0.5 + 0.5) * 255 + 0.5) for n in v.normal2])
-            field_generators.append(lambda v: [255])
-
-        if flags & 0x200:  # color2
-            vertex_format += '4B'
-            field_generators.append(lambda v: [int(c * 255) for c in v.color2])
-
-        if flags & 0x10:
-            vertex_format += '2H'
-            field_generators.append(lambda v: [int(c * 1024) for c in v.uv])
-
-        if flags & 0x20:
-            vertex_format += '2H'
-            field_generators.append(lambda v: [int(c * 1024) for c in v.uv2])
-
-        if flags & 0x40:
-            vertex_format += '2H'
-            field_generators.append(lambda v: [int(c * 1024) for c in v.uv3])
-
-
-        packed_vertices = bytearray()
-        pack = struct.Struct(vertex_format).pack
-
-        for v in verticesList:
-            data = list()
-            for gen in field_generators:
-                data.extend(gen(v))
-            packed_vertices.extend(pack(*data))
-
-        vertexBuffer.extend(packed_vertices)
+        vertexCount = sum(len(vertices) for vertices in verticesList)
+        vertexBuffer.extend(VertexLayout("tmd", self.modelFlags).encodeChunks(verticesList, self.weightQuantization))
         
         print("vertex buffer written")
         
         #write triangles buffer
         triBuffer = BinaryReader()
         
-        if len(verticesList) > 0xFFFF:
+        if vertexCount > 0xFFFF:
             self.modelFlags |= 0x800
         
         if self.modelFlags & 0x800:
@@ -486,15 +401,13 @@ class TMD(BrStruct):
         boneExtraInfoBuffer = BinaryReader()
         unkBoneBuffer = BinaryReader()
         
+        boneMatrixBuffer.write_bytes(boneMatrixBytes(self.bones))
+        boneExtraInfoBuffer.write_bytes(np.asarray([bone.extra for bone in self.bones], dtype='<i2').tobytes())
+        unkBoneInfo = [bone.offset for bone in self.bones if bone.extra > -1]
+        unkBoneBuffer.write_bytes(np.asarray(unkBoneInfo, dtype='<f4').reshape(-1, 3).tobytes())
+        
         for bone in self.bones:
-            boneMatrixBuffer.write_float32([value for row in bone.matrix for value in row])
             boneHierarchyBuffer.write_struct(bone, namesBuffer, self.version)
-            boneExtraInfoBuffer.write_int16(bone.extra)
-            if bone.extra > -1:
-                self.unkBoneInfo.append(bone.offset)
-        
-        for unkInfo in self.unkBoneInfo:
-            unkBoneBuffer.write_float32(unkInfo)
         
         print("Bone Data Written")
         
@@ -583,7 +496,7 @@ class TMD(BrStruct):
         patch_u32(trianglesCountPos, len(trianglesList))
         patch_u64(textureCountPos, len(self.textures))
         patch_u32(matTexCountPos, len(matTexList))
-        patch_u32(vertexCountPos, len(verticesList))
+        patch_u32(vertexCountPos, vertexCount)
 
         if len(self.bones):
             patch_u32(idxTblOffsetPos, indexTablesOffset)
@@ -680,7 +593,7 @@ class TMDModel(BrStruct):
                 matEntry.index = materialIdx
                 localEntries.append(matEntry)
             
-            if mesh.indexTable and boneCount >= 255:
+            if len(mesh.indexTable) and boneCount >= 255:
                 
                 idxTbl = TMDIndexTable()
                 idxTbl.indices = mesh.indexTable
@@ -747,25 +660,14 @@ class TMDSubmesh(BrStruct):
         self.trianglesStart = 0
     
     
-    def __br_read__(self, br, triangles, vertices):
+    def __br_read__(self, br, *args):
+        #vertexIndices and triangles are filled in by TMD.__br_read__
         self.trianglesCount = br.read_uint32()
         self.trianglesOffset = br.read_uint32()
         self.trianglesStart = br.read_uint32()
         unk = br.read_uint32()
-        
-        
-        vertex_map = {}  # Maps global index -> local index
-
-        for tris in triangles[self.trianglesStart : self.trianglesStart + self.trianglesCount]:
-            local_tri = []
-            for global_idx in tris:
-                if global_idx not in vertex_map:
-                    vertex_map[global_idx] = len(self.vertices)
-                    self.vertices.append(vertices[global_idx])
-                local_tri.append(vertex_map[global_idx])
-            self.triangles.append(local_tri)
     
-    def __br_write__(self, br: 'BinaryReader', trianglesList, verticesList, triangleOffsets):
+    def __br_write__(self, br: 'BinaryReader', trianglesList, verticesList, triangleOffsets, vertices = None):
         br.write_uint32(len(self.triangles))  # Write triangle count
         triangleOffsets.append(br.pos())  # Store the triangle offset
         br.write_uint32(0)  # Placeholder for triangle offset
@@ -773,18 +675,15 @@ class TMDSubmesh(BrStruct):
         t_startIndex = len(trianglesList)
         br.write_uint64(t_startIndex)
 
-        # Map from local vertex index (within this submesh) to global index (in verticesList)
-        local_to_global = {}
-
-        for i, v in enumerate(self.vertices):
-            global_idx = len(verticesList)
-            verticesList.append(v)
-            local_to_global[i] = global_idx
+        #vertices is a list of vertex objects or a structured vertex array, it is appended as one chunk
+        #and the local triangle indices are shifted by the vertices written before it
+        if vertices is None:
+            vertices = self.vertices
+        vertexStart = sum(len(chunk) for chunk in verticesList)
+        verticesList.append(vertices)
 
-        # Remap triangle vertex indices using local_to_global and append to the global triangle list
         for tri in self.triangles:
-            global_tri = [local_to_global[vi] for vi in tri]
-            trianglesList.append(global_tri)
+            trianglesList.append([vertexStart + int(vi) for vi in tri])
         
         
 
@@ -908,6 +807,11 @@ class TMDMaterial(BrStruct):
         params.extend(self.shaderParams)
         br.write_int32(self.unk)
 
+
+class TMDVertexBuffer(VertexBuffer):
+    converters = VERTEX_CONVERTERS["tmd"]
+
+
 class TMDVertex:
     def __init__(self) -> None:
         self.position = [0.0, 0.0, 0.0]
@@ -948,7 +852,7 @@ class TMDBone(BrStruct):
     
     def __br_write__(self, br, namesBuffer: BinaryReader, version):
         br.write_uint32(self.hash)
-        br.write_float32(self.posedLocation)
+        br.write_float32(list(self.posedLocation))
         br.write_int32(self.parentIndex)
         br.write_uint16(0)
         
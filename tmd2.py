@@ -1,16 +1,69 @@
 from .utils.PyBinaryReader.binary_reader import *
-from .pzze import readPZZE
+from .pzze import readPZZE, readPZZEHeader, iterPZZE
+from .meshops import buildSubmeshCSR, resolveSkinPalette, VertexBuffer, BONE_DTYPE, boneMatrixBytes
+from .vertexlayout import VertexLayout, VERTEX_CONVERTERS
 import numpy as np
 from itertools import chain
-import struct
+import os
+import mmap
+
+
+class LazySection:
+    #decodes a TMD2 section the first time one of its attributes is read
+    #it is a non-data descriptor, so once the loader has set the attribute the instance value is used directly
+    def __init__(self, loader):
+        self.loader = loader
+    
+    def __set_name__(self, owner, name):
+        self.name = name
+    
+    def __get__(self, obj, objtype = None):
+        if obj is None:
+            return self
+        if not obj.__dict__.get("_loading"):
+            raise AttributeError(f"{type(obj).__name__} has no attribute '{self.name}'")
+        getattr(obj, self.loader)()
+        return obj.__dict__[self.name]
+
 
 class TMD2(BrStruct):
+    
+    textures = LazySection("readTextures")
+    materialTextures = LazySection("readMaterialTextures")
+    shaderParams = LazySection("readShaderParams")
+    materials = LazySection("readMaterials")
+    rawVertices = LazySection("readVertices")
+    vertices = LazySection("readVertices")
+    triangles = LazySection("readTriangles")
+    allIndices = LazySection("readBones")
+    indexTables = LazySection("readBones")
+    bones = LazySection("readBones")
+    unkBoneInfo = LazySection("readBones")
+    boneData = LazySection("readBones")
+    boneMatrices = LazySection("readBones")
+    boneExtras = LazySection("readBones")
+    submeshEntries = LazySection("readSubmeshEntries")
+    submeshes = LazySection("readSubmeshes")
+    submeshVertexIndices = LazySection("readSubmeshes")
+    submeshVertexOffsets = LazySection("readSubmeshes")
+    submeshTriangles = LazySection("readSubmeshes")
+    submeshTriangleOffsets = LazySection("readSubmeshes")
+    models = LazySection("readModels")
+    BBoxCorners = LazySection("readBBoxCorners")
 
     def __init__(self) -> None:
         self.magic = 'tmd0'
         self.name = ""
         self.version = 0x209
         self.modelFlags = 0
+        #skin weight rounding used by the writer, "round" or "largest" (see meshops.quantizeWeights8)
+        self.weightQuantization = "round"
+        self._br = None
+        self._loading = False
+        self._source = None
+        self._arrays = {}
+        self._precision = None
+        self._skinWeights = None
         
         self.bones = []
         self.models = []
@@ -20,15 +73,32 @@ class TMD2(BrStruct):
         self.unkBoneInfo = []
         self.keyframes = []
         
-    def __br_read__(self, br: 'BinaryReader', file_name = "") -> None:
-
+    def __br_read__(self, br: 'BinaryReader', file_name = "", lazy = False, source = None, arrays = None, precision = None) -> None:
+        #with lazy only the header is parsed, every section is decoded the first time it is accessed
+        #source is the whole file buffer, br then only has to cover the header (see HEADER_READ_SIZE)
+        #sections are read from bounded copies of their bytes and large arrays are viewed in place
+        #arrays holds already decoded bone and submesh arrays (see tmd2cache), they are used instead of decoding
+        #precision sets how converted vertex attributes are kept, see TMD2VertexBuffer.setPrecision
+        if file_name:
+            self.name = file_name
+        
+        self.readHeader(br)
+        self._br = br if source is None else None
+        self._loading = True
+        self._source = source
+        self._arrays = arrays or {}
+        self._precision = precision
+        for name in LAZY_SECTIONS:
+            self.__dict__.pop(name, None)
+        
+        if not lazy:
+            self.loadAll()
+    
+    def readHeader(self, br: 'BinaryReader') -> None:
         self.magic = br.read_str(4)
         if self.magic != 'tmd0':
             raise ValueError(f"Invalid magic: {self.magic}")
 
-        if file_name:
-            self.name = file_name
-        
         self.flag1 = br.read_uint8()
         self.flag2 = br.read_uint8()
         self.modelFlags = br.read_uint16()
@@ -73,142 +143,127 @@ class TMD2(BrStruct):
             self.totalBoneCount = br.read_uint32()
             self.extraBoneInfoOffset = br.read_uint32()
             self.boneHierarchyOffset2 = br.read_uint32()
-        
-        #Textures Info
-        br.seek(self.texturesOffset, Whence.BEGIN)
+    
+    def loadAll(self):
+        #decodes every section that is still pending and drops the reference to the file buffer
+        for name in LAZY_SECTIONS:
+            getattr(self, name)
+        self._br = None
+        self._loading = False
+    
+    def sectionReader(self, offset, size):
+        #reader over a copy of size bytes at offset, offsets inside the section are relative to its start
+        #only the section is copied, never the whole file buffer
+        if self._source is not None:
+            return BinaryReader(self._source[offset: offset + size])
+        br = self._br
+        br.seek(offset, Whence.BEGIN)
+        return BinaryReader(br.read_bytes(size))
+    
+    def sectionEnd(self, offset):
+        #sections have no stored size, one ends where the next one starts or at the end of the file
+        offsets = [self.modelsOffset, self.subMeshEntriesOffset, self.materialsOffset, self.shaderParamsOffset,
+                   self.framesOffset, self.subMeshOffset, self.trianglesOffset, self.texturesOffset,
+                   self.materialTexturesOffset, self.verticesOffset, self.bboxOffset]
+        if self.modelFlags & 0x2000:
+            offsets += [self.indexTablesOffset, self.tableIndicesOffset, self.boneMatrixOffset, self.boneHierarchyOffset,
+                        self.extraBoneInfoOffset, self.boneHierarchyOffset2]
+        end = len(self._source) if self._source is not None else self._br.size()
+        return min([end] + [start for start in offsets if start > offset])
+    
+    def namesReader(self):
+        #reader over the names section, None when the file has no names
+        if self.namesOffset <= 0:
+            return None
+        return self.sectionReader(self.namesOffset, self.sectionEnd(self.namesOffset) - self.namesOffset)
+    
+    def readTextures(self):
+        br = self.sectionReader(self.texturesOffset, self.textureCount * 12)
         self.textures = br.read_struct(TMD2Texture, self.textureCount)
-        
-        #Material Textures Info
-        br.seek(self.materialTexturesOffset, Whence.BEGIN)
-        self.materialTextures = br.read_struct(TMD2MatTexture, self.materialTextureCount, self.textures)
-        
-        #Shader Params Info
-        br.seek(self.shaderParamsOffset, Whence.BEGIN)
+    
+    def readMaterialTextures(self):
+        #dependencies are resolved before seeking since they may be loaded from the same reader
+        textures = self.textures
+        br = self.sectionReader(self.materialTexturesOffset, self.materialTextureCount * 12)
+        self.materialTextures = br.read_struct(TMD2MatTexture, self.materialTextureCount, textures)
+    
+    def readShaderParams(self):
+        br = self.sectionReader(self.shaderParamsOffset, self.shaderParamsCount * 8)
         self.shaderParams = [br.read_float32(2)[1] for _ in range(self.shaderParamsCount)]
+    
+    def readMaterials(self):
+        materialTextures, shaderParams = self.materialTextures, self.shaderParams
+        br = self.sectionReader(self.materialsOffset, self.materialCount * 20)
+        self.materials = br.read_struct(TMD2Material, self.materialCount, materialTextures, shaderParams)
+    
+    def readVertices(self):
+        #rawVertices is a view over the file buffer when one was given, attributes are converted on access
+        npVertexAtt = VertexLayout("tmd2", self.modelFlags).readDtype
+        if self._source is not None:
+            self.rawVertices = np.frombuffer(self._source, npVertexAtt, self.vertexCount, self.verticesOffset)
+        else:
+            br = self._br
+            br.seek(self.verticesOffset, Whence.BEGIN)
+            self.rawVertices = br.read_structured_array(npVertexAtt, self.vertexCount)
         
-        #Material Info
-        br.seek(self.materialsOffset, Whence.BEGIN)
-        self.materials = br.read_struct(TMD2Material, self.materialCount, self.materialTextures, self.shaderParams)
-
-        
-        def unpack_normals(v):
-            # Strip 4th component and normalize XYZ
-            f = ((v.astype(np.float32) / 255.0) * 2.0) - 1.0
-            norm = np.linalg.norm(f, axis=-1, keepdims=True)
-            norm[norm == 0] = 1.0
-            return f / norm
-        
-        # Define converters for specific attributes
-        _attribute_converters = {
-            'normal':      unpack_normals,
-            'normal2':     unpack_normals,
-            'tangent':     unpack_normals,
-            'binormal':    unpack_normals,
-            'color':       lambda v: v.astype(np.float32) / 255.0,
-            'color2':      lambda v: v.astype(np.float32) / 255.0,
-            'boneWeights': lambda v: v.astype(np.float32) / 255.0,
-            'boneWeights2':lambda v: v.astype(np.float32) / 255.0,
-        }
-
-        # Determine vertex attributes based on flags
-        vertex_attributes = []
-        if self.modelFlags & 0x2:
-            vertex_attributes.append(('position', 'f4', 3))
-
-        if self.modelFlags & 0x400:
-            vertex_attributes.append(('boneWeights', 'u1', 4))
-            vertex_attributes.append(('boneIDs', 'u1', 4))
-
-        if self.modelFlags & 0x8000:
-            vertex_attributes.append(('boneWeights2', 'u1', 4))
-            vertex_attributes.append(('boneIDs2', 'u1', 4))
-
-        if self.modelFlags & 0x4:
-            vertex_attributes.append(('normal', 'u1', 4))
-
-        if self.modelFlags & 0x8:
-            vertex_attributes.append(('tangent', 'u1', 4))
-            vertex_attributes.append(('binormal', 'u1', 4))
-
-        if self.modelFlags & 0x80:
-            vertex_attributes.append(('color', 'u1', 4))
-
-        if self.modelFlags & 0x100:
-            vertex_attributes.append(('normal2', 'u1', 4))
-
-        if self.modelFlags & 0x200:
-            vertex_attributes.append(('color2', 'u1', 4))
-
-        if self.modelFlags & 0x10:
-            vertex_attributes.append(('uv', 'f4', 2))
-        if self.modelFlags & 0x20:
-            vertex_attributes.append(('uv2', 'f4', 2))
-        if self.modelFlags & 0x40:
-            vertex_attributes.append(('uv3', 'f4', 2))
-
-        # Read vertex buffer
-        br.seek(self.verticesOffset, Whence.BEGIN)
-        npVertexAtt = np.dtype(vertex_attributes)
-        self.rawVertices = br.read_structured_array(npVertexAtt, self.vertexCount)
-        
-        converted_dtype = []
-        for name, dtype, size in vertex_attributes:
-            # Force all converted attributes to be float32
-            if name in _attribute_converters:
-                converted_dtype.append((name, 'f4', size))
-            else:
-                converted_dtype.append((name, dtype, size))
-
-        # Create an empty array with the new dtype
-        converted_vertices = np.empty(self.vertexCount, dtype=np.dtype(converted_dtype))
-
-        # Fill it using the converters
-        for name, _, _ in vertex_attributes:
-            src = self.rawVertices[name]
-            if name in _attribute_converters:
-                converted_vertices[name] = _attribute_converters[name](src)
-            else:
-                converted_vertices[name] = src
-
-        # Replace original with the converted
-        self.vertices = converted_vertices
-
-        
-        # Convert fields in bulk
-        '''converted_attributes = {}
-        for name, dtype, size in vertex_attributes:
-            column = self.rawVertices[name]
-            if name in _attribute_converters:
-                column = _attribute_converters[name](column)
-            converted_attributes[name] = column
-
-        # Create and fill vertex objects
-        self.vertices = self.rawVertices'''
-        '''self.vertices = [TMD2Vertex() for _ in range(self.vertexCount)]
-        for i in range(self.vertexCount):
-            vertex = self.vertices[i]
-            for name in converted_attributes:
-                setattr(vertex, name, list(converted_attributes[name][i]))'''
-
-        #print(self.vertices[0].__dict__)
-
+        self.vertices = TMD2VertexBuffer(self.rawVertices, self._precision)
+    
+    def setVertexPrecision(self, precision = None):
+        self._precision = precision
+        if "vertices" in self.__dict__:
+            self.vertices.setPrecision(precision)
+    
+    def dropVertexCaches(self, names = None):
+        if "vertices" in self.__dict__:
+            self.vertices.dropCaches(names)
+        self._skinWeights = None
+    
+    def skinWeights(self):
+        #global bone indices and normalized weights of every vertex as two (vertexCount, 8) arrays
+        #the result is computed once and shared until dropVertexCaches
+        if self._skinWeights is None:
+            raw = self.rawVertices
+            submeshes = self.submeshes
+            boneIDs = np.zeros((len(raw), 8), dtype=np.uint8)
+            weights = np.zeros((len(raw), 8), dtype=np.uint8)
+            if self.modelFlags & 0x400:
+                boneIDs[:, :4] = raw['boneIDs']
+                weights[:, :4] = raw['boneWeights']
+            if self.modelFlags & 0x8000:
+                boneIDs[:, 4:] = raw['boneIDs2']
+                weights[:, 4:] = raw['boneWeights2']
+            
+            self._skinWeights = resolveSkinPalette(boneIDs, weights, self.submeshVertexIndices, self.submeshVertexOffsets,
+                                                   [mesh.indexTable for mesh in submeshes])
+        return self._skinWeights
+    
+    def readTriangles(self):
         # Read triangle info
-        br.seek(self.trianglesOffset, Whence.BEGIN)
-        if self.modelFlags & 0x800:
-            tribuffer = br.read_bytes(self.trianglesCount * 3 * 4)
-            self.triangles = np.frombuffer(tribuffer, dtype=np.uint32).reshape(-1, 3)
+        dtype = np.uint32 if self.modelFlags & 0x800 else np.uint16
+        if self._source is not None:
+            self.triangles = np.frombuffer(self._source, dtype, self.trianglesCount * 3, self.trianglesOffset).reshape(-1, 3)
         else:
-            tribuffer = br.read_bytes(self.trianglesCount * 3 * 2)
-            self.triangles = np.frombuffer(tribuffer, dtype=np.uint16).reshape(-1, 3)
-
-
+            br = self._br
+            br.seek(self.trianglesOffset, Whence.BEGIN)
+            tribuffer = br.read_bytes(self.trianglesCount * 3 * np.dtype(dtype).itemsize)
+            self.triangles = np.frombuffer(tribuffer, dtype=dtype).reshape(-1, 3)
+    
+    def readBones(self):
+        self.allIndices = []
+        self.indexTables = []
+        self.bones = []
+        self.boneData = np.zeros(0, BONE_DTYPE)
+        self.boneMatrices = np.zeros((0, 4, 4), np.float32)
+        self.boneExtras = np.zeros(0, np.int16)
+        self.unkBoneInfo = np.zeros((0, 3), np.float32)
+        
         if self.modelFlags & 0x2000:
             #read all indices for the index table
-            br.seek(self.tableIndicesOffset, Whence.BEGIN)
+            br = self.sectionReader(self.tableIndicesOffset, self.tableIndicesCount * 4)
             self.allIndices = br.read_uint32(self.tableIndicesCount)
             
             #pass the indices list to the index table class and read the individual index tables
-            br.seek(self.indexTablesOffset, Whence.BEGIN)
+            br = self.sectionReader(self.indexTablesOffset, self.indexTablesCount * 8)
             self.indexTables = br.read_struct(TMD2IndexTable, self.indexTablesCount, self.allIndices)
             
             if not self.indexTables:
@@ -216,49 +271,137 @@ class TMD2(BrStruct):
                 genericIndexTable.indices = [i for i in range(self.boneCount)]
                 self.indexTables = [genericIndexTable]
             
-            # read skeleton info
-            br.seek(self.boneHierarchyOffset, Whence.BEGIN)
-            self.bones = br.read_struct(TMD2Bone, self.boneCount, self.namesOffset)
-            
-            #read the matrix info
-            br.seek(self.boneMatrixOffset, Whence.BEGIN)
-            for i in range(self.boneCount):
-                self.bones[i].matrix = [br.read_float32(4) for _ in range(4)]
-            
+            #the skeleton is read as whole arrays, bones are thin wrappers with views into them
+            if "boneData" in self._arrays:
+                self.boneData, self.boneMatrices, self.boneExtras, self.unkBoneInfo = (self._arrays[name] for name in BONE_ARRAYS)
+            else:
+                br = self.sectionReader(self.boneHierarchyOffset, self.boneCount * BONE_DTYPE.itemsize)
+                self.boneData = np.array(br.read_structured_array(BONE_DTYPE, self.boneCount))
+                
+                #read the matrix info
+                br = self.sectionReader(self.boneMatrixOffset, self.boneCount * 64)
+                self.boneMatrices = np.array(br.read_structured_array(np.dtype('<f4'), self.boneCount * 16)).reshape(-1, 4, 4)
+                
+                br = self.sectionReader(self.extraBoneInfoOffset, self.boneCount * 2)
+                self.boneExtras = np.array(br.read_structured_array(np.dtype('<i2'), self.boneCount))
+                unkBoneInfoCount = int(np.count_nonzero(self.boneExtras != -1))
+                
+                #the offsets follow the extras, 16 byte aligned in the file
+                br = self.sectionReader(alignUp(self.extraBoneInfoOffset + self.boneCount * 2), unkBoneInfoCount * 12)
+                self.unkBoneInfo = np.array(br.read_structured_array(np.dtype('<f4'), unkBoneInfoCount * 3)).reshape(-1, 3)
             
-            unkBoneInfoCount = 0
-            br.seek(self.extraBoneInfoOffset, Whence.BEGIN)
+            hashes = self.boneData['hash'].tolist()
+            parents = self.boneData['parentIndex'].tolist()
+            unks = self.boneData['unk1'].tolist()
+            nameOffsets = self.boneData['nameOffset'].tolist()
+            extras = self.boneExtras.tolist()
+            names = self.namesReader()
             for i in range(self.boneCount):
-                bone = self.bones[i]
-                bone.extra = br.read_int16()
-                if bone.extra != -1:
-                    unkBoneInfoCount += 1
-            
-            br.align_pos(16)
-            self.unkBoneInfo = [br.read_float32(3) for i in range(unkBoneInfoCount)]
-            for bone in self.bones:
+                bone = TMD2Bone()
+                bone.hash = hashes[i]
+                bone.posedLocation = self.boneData['posedLocation'][i]
+                bone.parentIndex = parents[i]
+                bone.unk1 = unks[i]
+                bone.nameOffset = nameOffsets[i]
+                if names is not None:
+                    bone.name = names.read_str_at_offset(bone.nameOffset, encoding='utf-8')
+                else:
+                    bone.name = str(bone.hash)
+                
+                bone.matrix = self.boneMatrices[i]
+                bone.extra = extras[i]
                 if bone.extra > -1:
                     bone.offset = self.unkBoneInfo[bone.extra]
-            
-            #print(self.bones[0].__dict__)
-        
-        br.seek(self.subMeshEntriesOffset, Whence.BEGIN)
+                self.bones.append(bone)
+    
+    def readSubmeshEntries(self):
+        br = self.sectionReader(self.subMeshEntriesOffset, self.subMeshEntriesCount * 2)
         self.submeshEntries = br.read_struct(TMD2SubmeshEntry,self.subMeshEntriesCount)
-        
-        br.seek(self.subMeshOffset, Whence.BEGIN)
-        self.submeshes = br.read_struct(TMD2Submesh,self.subMeshCount, self.triangles, self.vertices)
-        
-        #read model info
-        br.seek(self.modelsOffset, Whence.BEGIN)
-        self.models = br.read_struct(TMD2Model, self.modelCount, self.indexTables, self.submeshEntries, self.submeshes, self.materials, self.namesOffset)
-        
-        #read the unknown section
-        br.seek(self.bboxOffset, Whence.BEGIN)
+    
+    def readSubmeshes(self):
+        br = self.sectionReader(self.subMeshOffset, self.subMeshCount * 8)
+        self.submeshes = br.read_struct(TMD2Submesh,self.subMeshCount)
+        
+        #vertex sets and local triangles of all submeshes are built at once, each submesh gets views into them
+        if "submeshVertexIndices" in self._arrays:
+            (self.submeshVertexIndices, self.submeshVertexOffsets,
+             self.submeshTriangles, self.submeshTriangleOffsets) = (self._arrays[name] for name in SUBMESH_ARRAYS)
+        else:
+            (self.submeshVertexIndices, self.submeshVertexOffsets,
+             self.submeshTriangles, self.submeshTriangleOffsets) = buildSubmeshCSR(
+                self.triangles, [m.trianglesStart for m in self.submeshes], [m.trianglesCount for m in self.submeshes])
+        
+        vertexOffsets, triangleOffsets = self.submeshVertexOffsets, self.submeshTriangleOffsets
+        for i, mesh in enumerate(self.submeshes):
+            mesh.vertexIndices = self.submeshVertexIndices[vertexOffsets[i]: vertexOffsets[i + 1]]
+            mesh.triangles = self.submeshTriangles[triangleOffsets[i]: triangleOffsets[i + 1]]
+        #material and index table of each submesh are assigned while reading the models
+        self.models
+    
+    def readModels(self):
+        indexTables, submeshEntries, submeshes, materials = self.indexTables, self.submeshEntries, self.submeshes, self.materials
+        br = self.sectionReader(self.modelsOffset, self.modelCount * 44)
+        self.models = br.read_struct(TMD2Model, self.modelCount, indexTables, submeshEntries, submeshes, materials, self.namesReader())
+    
+    def readBBoxCorners(self):
+        br = self.sectionReader(self.bboxOffset, (self.modelCount + 1) * 96)
         self.BBoxCorners = br.read_struct(TMD2BoundingBox, self.modelCount + 1)
+    
+    def submeshVertices(self, mesh, index = 0):
+        #vertices written for a submesh, meshes of a read file have no vertex list and use their rows of rawVertices
+        if len(mesh.vertices) or not len(mesh.triangles):
+            return mesh.vertices
+        vertexIndices = getattr(mesh, "vertexIndices", None)
+        rawVertices = getattr(self, "rawVertices", None)
+        if vertexIndices is None or rawVertices is None:
+            raise ValueError(f"Submesh {index} has triangles but no vertices")
+        return rawVertices[vertexIndices]
                 
         
     def __br_write__(self, br: 'BinaryReader', *args) -> None:
-        #magic
+        #the layout is computed first, then the header and sections are written once each
+        header, sections, end = self.writeLayout(br.pos())
+        br.write_bytes(header)
+        br.align(16)
+        for _, data in sections:
+            br.write_bytes(bytes(data))
+            br.align(16)
+    
+    def write(self, target):
+        #writes the file straight to a path or an open binary file, sections go out one by one without being joined
+        #an mmap works as target as long as it is at least as large as the file, the file size is returned
+        if isinstance(target, (str, os.PathLike)):
+            with open(target, "wb") as f:
+                return self.write(f)
+        
+        header, sections, end = self.writeLayout()
+        target.write(header)
+        pos = len(header)
+        for offset, data in sections:
+            target.write(bytes(offset - pos))
+            target.write(memoryview(data))
+            pos = offset + len(data)
+        target.write(bytes(end - pos))
+        return end
+    
+    def writeLayout(self, base = 0):
+        #returns the header bytes, (offset, data) for every section in file order and the end of the file
+        #sections start 16 byte aligned after base, data is a uint8 array that views the encoded section
+        counts, sections = self.writeSections()
+        
+        pos = alignUp(base + len(self.writeHeader({}, counts)))
+        offsets = {}
+        placed = []
+        for name, data in sections:
+            offsets[name] = pos
+            placed.append((pos, data))
+            pos = alignUp(pos + len(data))
+        
+        return self.writeHeader(offsets, counts), placed, pos
+    
+    def writeHeader(self, offsets, counts):
+        #offsets of sections that are not written are 0
+        br = BinaryReader()
         br.write_str_fixed("tmd0",4)
         br.write_uint8(self.flag1)
         br.write_uint8(self.flag2)
@@ -269,128 +412,69 @@ class TMD2(BrStruct):
         br.write_int16(-1)
         br.write_float32(self.boundingBox)
         
-        modelOffsetPos = br.pos()
-        br.write_uint64(0)
-        br.write_uint32(0)
-        
-        entriesOffsetPos = br.pos()
-        br.write_uint32(0)
-        
-        materialsOffsetPos = br.pos()
-        br.write_uint32(0)
-        
-        paramsOffsetPos = br.pos()
-        br.write_uint32(0)
-        
-        namesOffsetPos = br.pos()
-        br.write_uint64(0)
-        
-        submeshOffsetPos = br.pos()
-        br.write_uint32(0)
-        
-        trianglesOffsetPos = br.pos()
-        br.write_uint32(0)
-        
-        texturesOffsetPos = br.pos()
-        br.write_uint64(0)
-        
-        matTexOffsetPos = br.pos()
+        br.write_uint64(offsets.get("models", 0))
         br.write_uint32(0)
-        
-        verticesOffsetPos = br.pos()
-        br.write_uint32(0)
-        
-        bboxCornersOffsetPos = br.pos()
-        br.write_uint64(0)
+        br.write_uint32(offsets.get("submeshEntries", 0))
+        br.write_uint32(offsets.get("materials", 0))
+        br.write_uint32(offsets.get("shaderParams", 0))
+        br.write_uint64(offsets.get("names", 0))
+        br.write_uint32(offsets.get("submeshes", 0))
+        br.write_uint32(offsets.get("triangles", 0))
+        br.write_uint64(offsets.get("textures", 0))
+        br.write_uint32(offsets.get("materialTextures", 0))
+        br.write_uint32(offsets.get("vertices", 0))
+        br.write_uint64(offsets.get("BBoxCorners", 0))
         
         br.write_uint32(len(self.models))
         br.write_uint64(0)
-        
-        entriesCountPos = br.pos()
-        br.write_uint32(0)
-        
-        materialCountPos = br.pos()
-        br.write_uint32(0)
-        
-        paramCountPos = br.pos()
-        br.write_uint32(0)
-        
+        br.write_uint32(counts["submeshEntries"])
+        br.write_uint32(counts["materials"])
+        br.write_uint32(counts["shaderParams"])
         br.write_uint64(self.afterImageValue) #I don't know what this value does but it can be 0
-        
-        submeshCountPos = br.pos()
-        br.write_uint32(0)
-        
-        trianglesCountPos = br.pos()
-        br.write_uint32(0)
-        
-        textureCountPos = br.pos()
-        br.write_uint64(0)
-        
-        matTexCountPos = br.pos()
-        br.write_uint32(0)
-        
-        vertexCountPos = br.pos()
-        br.write_uint32(0)
-        
-        if len(self.bones):
-            idxTblOffsetPos = br.pos()
-            br.write_uint32(0)
-            
-            indicesOffsetPos = br.pos()
-            br.write_uint32(0)
-            
-            matricesOffsetPos = br.pos()
-            br.write_uint32(0)
-            
-            hierarchyOffsetPos = br.pos()
-            br.write_uint32(0)
-            
-            idxTblCountPos = br.pos()
-            br.write_uint32(0)
-            
-            indicesCountPos = br.pos()
-            br.write_uint32(0)
-            
-            boneCountPos = br.pos()
-            br.write_uint32(0)
-            
-            boneCount2Pos = br.pos()
-            br.write_uint32(0)
-            
-            extraInfoOffsetPos = br.pos()
-            br.write_uint32(0)
-            
-            hierarchyOffset2Pos = br.pos()
-            br.write_uint32(0)
-        
-        br.align(16)
-            
-        #we have to write the rest of the file before writing the rest of the header
+        br.write_uint32(counts["submeshes"])
+        br.write_uint32(counts["triangles"])
+        br.write_uint64(counts["textures"])
+        br.write_uint32(counts["materialTextures"])
+        br.write_uint32(counts["vertices"])
+        
+        if counts["bones"]:
+            br.write_uint32(offsets.get("indexTables", 0))
+            br.write_uint32(offsets.get("allIndices", 0))
+            br.write_uint32(offsets.get("boneMatrices", 0))
+            br.write_uint32(offsets.get("bones", 0))
+            br.write_uint32(counts["indexTables"])
+            br.write_uint32(counts["allIndices"])
+            br.write_uint32(counts["bones"])
+            br.write_uint32(counts["bones"])
+            br.write_uint32(offsets.get("boneExtras", 0))
+            br.write_uint32(offsets.get("unkBoneInfo", 0))
+        
+        return bytes(br.buffer())
+    
+    def writeSections(self):
+        #encodes every section without placing it, returns the header counts and (name, data) in file order
+        #large sections are NumPy arrays, the small tables are encoded with BinaryReader
         matBuffer = BinaryReader()
         paramBuffer = BinaryReader()
         matTexBuffer = BinaryReader()
         texBuffer = BinaryReader()
         
-        matTexList = []
-        paramsList = []
+        #index maps and shared material texture/shader param runs
+        plan = TMD2WritePlan(self)
         
         # write materials
-        matBuffer.write_struct(self.materials, matTexList, paramsList)
-        print("Materials Written")
+        matBuffer.write_struct(self.materials, plan)
         
         #write params
-        for param in paramsList:
+        for param in plan.shaderParams:
             paramBuffer.pad(4)
             paramBuffer.write_float32(param)
-        print("Params Written")
         
         #write material textures
-        matTexBuffer.write_struct(matTexList, self.textures)
-        print("Material Textures Written")
+        matTexBuffer.write_struct(plan.matTextures, plan)
         
         #write texture info
         texBuffer.write_struct(self.textures)
-        print("Textures Written")
         
         
         #write models
@@ -400,7 +484,7 @@ class TMD2(BrStruct):
         indexTablesList = []
         submeshEntries = []
         submeshes = []
-        modelBuffer.write_struct(self.models, indexTablesList, submeshEntries, submeshes, self.materials, namesBuffer, len(self.bones))
+        modelBuffer.write_struct(self.models, indexTablesList, submeshEntries, submeshes, plan, namesBuffer, len(self.bones))
         
         self.submeshes= submeshes
         
@@ -409,132 +493,40 @@ class TMD2(BrStruct):
         entryBuffer.write_struct(submeshEntries)
         
         
-        #write the submeshes
-        trianglesList = []
-        verticesList = []
+        #write the submeshes, their vertices and triangles are concatenated in submesh order
+        #each submesh's local triangle indices are shifted by the vertices of the submeshes before it
+        vertexChunks = [self.submeshVertices(submesh, i) for i, submesh in enumerate(submeshes)]
+        localTriangles = [np.asarray(submesh.triangles, dtype=np.int64).reshape(-1, 3) for submesh in submeshes]
+        vertexCounts = np.array([len(vertices) for vertices in vertexChunks], dtype=np.int64)
+        triangleCounts = np.array([len(triangles) for triangles in localTriangles], dtype=np.int64)
+        vertexStarts = np.cumsum(vertexCounts) - vertexCounts
+        triangleStarts = np.cumsum(triangleCounts) - triangleCounts
+        vertexCount = int(vertexCounts.sum())
+        trianglesCount = int(triangleCounts.sum())
         
         submeshBuffer = BinaryReader()
-        submeshBuffer.write_struct(submeshes, trianglesList, verticesList)
-        print("submeshes Written")
-        
-        def encode_weights_8(total_weights):
-            scaled = [int(round(w * 255)) for w in total_weights]
-            diff = 255 - sum(scaled)
-            if diff != 0:
-                # Distribute diff to the largest weight
-                max_idx = max(range(len(scaled)), key=lambda i: scaled[i])
-                scaled[max_idx] = min(255, max(0, scaled[max_idx] + diff))
-            return scaled[:4], scaled[4:]
-        
-        '''def encode_weights_8(total_weights):
-            scaled = [int(round(w * 255)) for w in total_weights]
-
-            return scaled[:4], scaled[4:]'''
+        for submesh, triangleStart in zip(submeshes, triangleStarts):
+            submeshBuffer.write_struct(submesh, int(triangleStart))
         
         #write the vertex buffer
-        vertexBuffer = BinaryReader()
-        vertex_format = ''
-        field_generators = []
-        flags = self.modelFlags
-        if flags & 0x2:  # position
-            vertex_format += '3f'
-            field_generators.append(lambda v: v.position)
-
+        vertices = VertexLayout("tmd2", self.modelFlags).encodeArray(vertexChunks, self.weightQuantization)
         
-        if flags & 0x400:  # bone weights + IDs
-            vertex_format += '4B4B'
-            field_generators.append(lambda v: encode_weights_8(v.boneWeights + v.boneWeights2)[0])  # boneWeights
-            field_generators.append(lambda v: v.boneIDs)
-
-        if flags & 0x8000:  # bone weights2 + IDs2
-            vertex_format += '4B4B'
-            field_generators.append(lambda v: encode_weights_8(v.boneWeights + v.boneWeights2)[1])  # boneWeights2
-            field_generators.append(lambda v: v.boneIDs2)
-
-        if flags & 0x4:  # normal
-            vertex_format += '3B B'
-            field_generators.append(lambda v: [int((n * 0.5 + 0.5) * 255 + 0.5) for n in v.normal])
-            field_generators.append(lambda v: [255])
-
-        if flags & 0x8:  # tangent + binormal
-            vertex_format += '3B B 3B B'
-            field_generators.append(lambda v: [int((f * 0.5 + 0.5) * 255 + 0.5) for f in v.tangent])
-            field_generators.append(lambda v: [0])
-            field_generators.append(lambda v: [int((f * 0.5 + 0.5) * 255 + 0.5) for f in v.binormal])
-            field_generators.append(lambda v: [0])
-
-        if flags & 0x80:  # color
-            vertex_format += '4B'
-            field_generators.append(lambda v: [int(c * 255) for c in v.color])
-
-        if flags & 0x100:  # normal2
-            vertex_format += '3B B'
-            field_generators.append(lambda v: [int((n * 0.5 + 0.5) * 255 + 0.5) for n in v.normal2])
-            field_generators.append(lambda v: [255])
-
-        if flags & 0x200:  # color2
-            vertex_format += '4B'
-            field_generators.append(lambda v: [int(c * 255) for c in v.color2])
-
-        if flags & 0x10:
-            vertex_format += '2f'
-            field_generators.append(lambda v: v.uv)
-
-        if flags & 0x20:
-            vertex_format += '2f'
-            field_generators.append(lambda v: v.uv2)
-
-        if flags & 0x40:
-            vertex_format += '2f'
-            field_generators.append(lambda v: v.uv3)
-
-
-        packed_vertices = bytearray()
-        pack = struct.Struct(vertex_format).pack
-
-        for v in verticesList:
-            data = list()
-            for gen in field_generators:
-                data.extend(gen(v))
-            packed_vertices.extend(pack(*data))
-
-        vertexBuffer.extend(packed_vertices)
-        
-        print("vertex buffer written")
-        
-        #write triangles buffer
-        triBuffer = BinaryReader()
-        
-        if len(verticesList) > 0xFFFF:
+        #write triangles buffer, 0x800 (32 bit indices) is decided before the header is encoded
+        if vertexCount > 0xFFFF:
             self.modelFlags |= 0x800
         
-        if self.modelFlags & 0x800:
-            for triangle in trianglesList:
-                triBuffer.write_uint32(triangle)
-        else:
-            for triangle in trianglesList:
-                triBuffer.write_uint16(triangle)
-
-        print("triangles buffer written")
-        
+        triangles = np.concatenate(localTriangles) if localTriangles else np.zeros((0, 3), dtype=np.int64)
+        triangles += np.repeat(vertexStarts, triangleCounts)[:, None]
+        triangles = triangles.astype('<u4' if self.modelFlags & 0x800 else '<u2')
         
         #write bone buffers
-        boneMatrixBuffer = BinaryReader()
-        boneHierarchyBuffer = BinaryReader()
-        boneExtraInfoBuffer = BinaryReader()
-        unkBoneBuffer = BinaryReader()
+        boneMatrices = boneMatrixBytes(self.bones)
+        boneExtras = np.asarray([bone.extra for bone in self.bones], dtype='<i2')
+        unkBoneInfo = np.asarray([bone.offset for bone in self.bones if bone.extra > -1], dtype='<f4').reshape(-1, 3)
         
+        boneHierarchyBuffer = BinaryReader()
         for bone in self.bones:
-            boneMatrixBuffer.write_float32([value for row in bone.matrix for value in row])
             boneHierarchyBuffer.write_struct(bone, namesBuffer, self.version)
-            boneExtraInfoBuffer.write_int16(bone.extra)
-            if bone.extra > -1:
-                self.unkBoneInfo.append(bone.offset)
-        
-        for unkInfo in self.unkBoneInfo:
-            unkBoneBuffer.write_float32(unkInfo)
-        
-        print("Bone Data Written")
         
         #write index tables
         indexTblBuffer = BinaryReader()
@@ -544,101 +536,100 @@ class TMD2(BrStruct):
         indexTblBuffer.write_struct(indexTablesList, indicesList)
         indicesBuffer.write_uint32(indicesList)
         
-        print("Indices Written")
-        
         bboxCornersBuffer = BinaryReader()
         
         bboxCornersBuffer.write_struct(self.BBoxCorners)
         
-        print("Unknown section written")
         
-        # Write all buffers and record their offsets
-        def write_and_get_offset(buffer: BinaryReader, alignment=16):
-            offset = br.pos()
-            br.write_bytes(bytes(buffer.buffer()))
-            br.align(alignment)
-            return offset
-
-
-        modelOffset = write_and_get_offset(modelBuffer)
-        entriesOffset = write_and_get_offset(entryBuffer)
-        materialsOffset = write_and_get_offset(matBuffer)
-        paramsOffset = write_and_get_offset(paramBuffer)
-        submeshOffset = write_and_get_offset(submeshBuffer)
-        trianglesOffset = write_and_get_offset(triBuffer)
-        texturesOffset = write_and_get_offset(texBuffer)
-        matTexOffset = write_and_get_offset(matTexBuffer)
-        verticesOffset = write_and_get_offset(vertexBuffer)
+        sections = [("models", modelBuffer), ("submeshEntries", entryBuffer), ("materials", matBuffer),
+                    ("shaderParams", paramBuffer), ("submeshes", submeshBuffer), ("triangles", triangles),
+                    ("textures", texBuffer), ("materialTextures", matTexBuffer), ("vertices", vertices)]
         
-
-        # Optional bone section
+        # Optional bone section, index tables are only used with 255 or more bones
         if len(self.bones):
-            if len(self.bones) >= 255:
-                indexTablesOffset = write_and_get_offset(indexTblBuffer)
-                tableIndicesOffset = write_and_get_offset(indicesBuffer)
-            else:
-                indexTablesOffset = tableIndicesOffset = 0
+            if len(self.bones) < 255:
                 indicesList = []
                 indexTablesList = []
-            boneMatrixOffset = write_and_get_offset(boneMatrixBuffer)
-            extraBoneInfoOffset = write_and_get_offset(boneExtraInfoBuffer)
-            unkBoneOffset = write_and_get_offset(unkBoneBuffer)
-            boneHierarchyOffset = write_and_get_offset(boneHierarchyBuffer)
+            else:
+                sections += [("indexTables", indexTblBuffer), ("allIndices", indicesBuffer)]
+            sections += [("boneMatrices", boneMatrices), ("boneExtras", boneExtras),
+                         ("unkBoneInfo", unkBoneInfo), ("bones", boneHierarchyBuffer)]
+        
+        sections += [("BBoxCorners", bboxCornersBuffer), ("names", namesBuffer)]
+        
+        counts = {"submeshEntries": len(submeshEntries), "materials": len(self.materials), "shaderParams": len(plan.shaderParams),
+                  "submeshes": len(submeshes), "triangles": trianglesCount, "textures": len(self.textures),
+                  "materialTextures": len(plan.matTextures), "vertices": vertexCount, "indexTables": len(indexTablesList),
+                  "allIndices": len(indicesList), "bones": len(self.bones)}
+        return counts, [(name, sectionBytes(data)) for name, data in sections]
+        
+            
         
-        bboxCornersOffset = write_and_get_offset(bboxCornersBuffer)
-        namesOffset = write_and_get_offset(namesBuffer)
 
-        # Patch header
-        def patch_u32(pos, val):
-            here = br.pos()
-            br.seek(pos)
-            br.write_uint32(val)
-            br.seek(here)
+def alignUp(offset, alignment = 16):
+    return (offset + alignment - 1) // alignment * alignment
 
-        def patch_u64(pos, val):
-            here = br.pos()
-            br.seek(pos)
-            br.write_uint64(val)
-            br.seek(here)
 
-        patch_u64(modelOffsetPos, modelOffset)
-        patch_u32(entriesOffsetPos, entriesOffset)
-        patch_u32(materialsOffsetPos, materialsOffset)
-        patch_u32(paramsOffsetPos, paramsOffset)
-        patch_u64(namesOffsetPos, namesOffset)
-        patch_u32(submeshOffsetPos, submeshOffset)
-        patch_u32(trianglesOffsetPos, trianglesOffset)
-        patch_u64(texturesOffsetPos, texturesOffset)
-        patch_u32(matTexOffsetPos, matTexOffset)
-        patch_u32(verticesOffsetPos, verticesOffset)
-        patch_u64(bboxCornersOffsetPos, bboxCornersOffset)
+def sectionBytes(data):
+    #uint8 view of an encoded section, BinaryReader buffers are copied once, NumPy arrays are not copied
+    if isinstance(data, BinaryReader):
+        data = data.buffer()
+    if isinstance(data, np.ndarray):
+        return np.ascontiguousarray(data).reshape(-1).view(np.uint8)
+    return np.frombuffer(data, dtype=np.uint8)
 
-        patch_u32(entriesCountPos, len(submeshEntries))
-        patch_u32(materialCountPos, len(self.materials))
-        patch_u32(paramCountPos, len(paramsList))
-        patch_u32(submeshCountPos, len(self.submeshes))
-        patch_u32(trianglesCountPos, len(trianglesList))
-        patch_u64(textureCountPos, len(self.textures))
-        patch_u32(matTexCountPos, len(matTexList))
-        patch_u32(vertexCountPos, len(verticesList))
 
-        if len(self.bones):
-            patch_u32(idxTblOffsetPos, indexTablesOffset)
-            patch_u32(indicesOffsetPos, tableIndicesOffset)
-            patch_u32(matricesOffsetPos, boneMatrixOffset)
-            patch_u32(hierarchyOffsetPos, boneHierarchyOffset)
-            patch_u32(idxTblCountPos, len(indexTablesList))
-            patch_u32(indicesCountPos, len(indicesList))
-            patch_u32(boneCountPos, len(self.bones))
-            patch_u32(boneCount2Pos, len(self.bones))
-            patch_u32(extraInfoOffsetPos, extraBoneInfoOffset)
-            patch_u32(hierarchyOffset2Pos, unkBoneOffset)
-    
-    
-        print("done")
+#the header is at most 0xC4 bytes (0x9C without the bone table offsets), readers given a source only need this prefix
+HEADER_READ_SIZE = 0x100
+LAZY_SECTIONS = [name for name, value in vars(TMD2).items() if isinstance(value, LazySection)]
+BONE_ARRAYS = ["boneData", "boneMatrices", "boneExtras", "unkBoneInfo"]
+SUBMESH_ARRAYS = ["submeshVertexIndices", "submeshVertexOffsets", "submeshTriangles", "submeshTriangleOffsets"]
+
+
+class TMD2WritePlan:
+    #everything the writer looks up more than once, built in one pass over the materials
+    #textures and materials are indexed by identity, identical material texture runs and
+    #shader param runs are stored once and shared by every material that uses them
+    def __init__(self, tmd: TMD2):
+        self.textureIndices = {id(texture): i for i, texture in enumerate(tmd.textures)}
+        self.materialIndices = {}
+        for i, material in enumerate(tmd.materials):
+            self.materialIndices.setdefault(id(material), i)
         
+        self.matTextures = []
+        self.shaderParams = []
+        self.matTextureRuns = {}
+        self.shaderParamRuns = {}
+        matTextureStarts = {}
+        shaderParamStarts = {}
+        
+        for material in tmd.materials:
+            #runs are keyed by the bytes they are written as
+            key = tuple((matTexture.texture.hash, self.textureIndex(matTexture.texture), matTexture.unk1, matTexture.unk2, matTexture.slot)
+                        for matTexture in material.textures)
+            if key not in matTextureStarts:
+                matTextureStarts[key] = len(self.matTextures)
+                self.matTextures.extend(material.textures)
+            self.matTextureRuns[id(material)] = (matTextureStarts[key], len(key))
             
-        
+            key = np.asarray(material.shaderParams, dtype="<f4").tobytes()
+            if key not in shaderParamStarts:
+                shaderParamStarts[key] = len(self.shaderParams)
+                self.shaderParams.extend(material.shaderParams)
+            self.shaderParamRuns[id(material)] = (shaderParamStarts[key], len(material.shaderParams))
+    
+    def textureIndex(self, texture):
+        index = self.textureIndices.get(id(texture))
+        if index is None:
+            raise ValueError(f"Texture {texture.hash:08x} is not in the model's textures")
+        return index
+    
+    def materialIndex(self, material):
+        index = self.materialIndices.get(id(material))
+        if index is None:
+            raise ValueError(f"Material {material.hash:08x} is not in the model's materials")
+        return index
+
 
 class TMD2BoundingBox(BrStruct):
     def __init__(self) -> None:
@@ -663,7 +654,8 @@ class TMD2Model(BrStruct):
         self.hashFlag = 0
         self.nameFlag = 0
     
-    def __br_read__(self, br: 'BinaryReader', indexTables, entries, submeshes, materials, namesOffset) -> None:
+    def __br_read__(self, br: 'BinaryReader', indexTables, entries, submeshes, materials, names = None) -> None:
+        #names is a reader over the names section (see TMD2.namesReader)
         self.boundingBox = br.read_float32(6)
         self.entriesCount = br.read_uint16()
         self.hashFlag =  br.read_uint8()
@@ -673,8 +665,8 @@ class TMD2Model(BrStruct):
         self.hash =  br.read_uint32()
         self.unk0 =  br.read_uint32()
         
-        if namesOffset > 0 and self.nameOffset != -1:
-            self.name = br.read_str_at_offset(namesOffset + self.nameOffset)
+        if names is not None and self.nameOffset != -1:
+            self.name = names.read_str_at_offset(self.nameOffset)
         else:
             self.name = f"{str(self.hash)}"
         
@@ -696,7 +688,7 @@ class TMD2Model(BrStruct):
                 self.meshes.append(mesh)
             
     
-    def __br_write__(self, br: 'BinaryReader', indexTables, entries, submeshes, materials, namesBuffer, boneCount) -> None:
+    def __br_write__(self, br: 'BinaryReader', indexTables, entries, submeshes, plan, namesBuffer, boneCount) -> None:
         br.write_float32(self.boundingBox)
         #br.write_uint16(len(self.meshes))
         
@@ -707,8 +699,7 @@ class TMD2Model(BrStruct):
         
         for mesh in self.meshes:
             mesh: TMD2Submesh
-            materialIndex = materials.index(mesh.material)
-            print(materialIndex)
+            materialIndex = plan.materialIndex(mesh.material)
             if materialIdx != materialIndex:
                 #update the material index
                 materialIdx = materialIndex
@@ -786,49 +777,20 @@ class TMD2Submesh(BrStruct):
         self.trianglesStart = 0
     
     
-    def __br_read__(self, br, triangles, vertices):
+    def __br_read__(self, br, *args):
+        #vertexIndices and triangles are filled in by TMD2.readSubmeshes
         self.trianglesCount = br.read_uint32()
         self.trianglesStart = br.read_uint32()
-        
-        tris = triangles[self.trianglesStart : self.trianglesStart + self.trianglesCount]
-
-        self.vertexIndices = np.unique(tris)
-
-        index_map = {global_idx: local_idx for local_idx, global_idx in enumerate(self.vertexIndices)}
-
-        remapped_tris = np.vectorize(index_map.get)(tris)  # shape: (count, 3)
-        self.triangles = remapped_tris.tolist()  # Convert to list of lists
-
-        '''vertex_map = {}  # Maps global index -> local index
-
-        for tris in triangles[self.trianglesStart : self.trianglesStart + self.trianglesCount]:
-            local_tri = []
-            for global_idx in tris:
-                if global_idx not in vertex_map:
-                    vertex_map[global_idx] = len(self.vertices)
-                    self.vertices.append(vertices[global_idx])
-                local_tri.append(vertex_map[global_idx])
-            self.triangles.append(local_tri)'''
     
-    def __br_write__(self, br, trianglesList, verticesList):
-        br.write_uint32(len(self.triangles))  # Write triangle count
-
-        # Store the starting triangle index
-        t_startIndex = len(trianglesList)
-        br.write_uint32(t_startIndex)
-
-        # Map from local vertex index (within this submesh) to global index (in verticesList)
-        local_to_global = {}
-
-        for i, v in enumerate(self.vertices):
-            global_idx = len(verticesList)
-            verticesList.append(v)
-            local_to_global[i] = global_idx
-
-        # Remap triangle vertex indices using local_to_global and append to the global triangle list
-        for tri in self.triangles:
-            global_tri = [local_to_global[vi] for vi in tri]
-            trianglesList.append(global_tri)
+    def skinWeights(self, tmd):
+        #rows of tmd.skinWeights() for the vertices of this submesh, in vertexIndices order
+        boneIDs, weights = tmd.skinWeights()
+        return boneIDs[self.vertexIndices], weights[self.vertexIndices]
+    
+    def __br_write__(self, br, trianglesStart):
+        #the vertices and triangles themselves are gathered by TMD2.__br_write__
+        br.write_uint32(len(self.triangles))
+        br.write_uint32(trianglesStart)
         
         
 
@@ -890,9 +852,9 @@ class TMD2MatTexture(BrStruct):
         self.unk2 = br.read_int16()
         self.slot = br.read_int16() >> 8
     
-    def __br_write__(self, br, textures):
+    def __br_write__(self, br, plan):
         br.write_uint32(self.texture.hash)
-        br.write_uint16(textures.index(self.texture))
+        br.write_uint16(plan.textureIndex(self.texture))
         br.write_int16(self.unk1)
         br.write_int16(self.unk2)
         br.write_int8(0)
@@ -920,20 +882,24 @@ class TMD2Material(BrStruct):
         self.unk = br.read_int32()
         self.shaderParams = params[self.shaderParamsStartIndex: self.shaderParamsStartIndex + self.shaderParamsCount]
 
-    def __br_write__(self, br: 'BinaryReader', matTextures, params) -> None:
+    def __br_write__(self, br: 'BinaryReader', plan) -> None:
         br.write_uint32(self.hash)
         br.write_str_fixed(self.shaderID,4)
-        br.write_uint16(len(matTextures))
-        br.write_uint16(len(self.textures))
-        #add textures from this material to the material textures list
-        matTextures.extend(self.textures)
-        
-        br.write_uint16(len(params))
-        br.write_uint16(len(self.shaderParams))
-        #add params from this material to the shader params list
-        params.extend(self.shaderParams)
+        #material texture and shader param runs may be shared with other materials, see TMD2WritePlan
+        matTextureStart, matTextureCount = plan.matTextureRuns[id(self)]
+        br.write_uint16(matTextureStart)
+        br.write_uint16(matTextureCount)
+        
+        shaderParamStart, shaderParamCount = plan.shaderParamRuns[id(self)]
+        br.write_uint16(shaderParamStart)
+        br.write_uint16(shaderParamCount)
         br.write_int32(self.unk)
 
+
+class TMD2VertexBuffer(VertexBuffer):
+    converters = VERTEX_CONVERTERS["tmd2"]
+
+
 class TMD2Vertex:
     def __init__(self) -> None:
         self.position = [0.0, 0.0, 0.0]
@@ -977,7 +943,7 @@ class TMD2Bone(BrStruct):
     
     def __br_write__(self, br, namesBuffer: BinaryReader, version):
         br.write_uint32(self.hash)
-        br.write_float32(self.posedLocation)
+        br.write_float32(list(self.posedLocation))
         br.write_int32(self.parentIndex)
         br.write_uint16(0)
         
@@ -1006,6 +972,37 @@ class TMD2IndexTable(BrStruct):
         indicesList.extend(self.indices)
 
 
+def readTMD2Data(path):
+    #raw tmd0 bytes of a file, PZZE files are inflated in chunks into a single buffer
+    with open(path, "rb") as f:
+        if f.read(4) != b"PZZE":
+            f.seek(0)
+            return f.read()
+        f.seek(0)
+        header = readPZZEHeader(f)
+        data = bytearray()
+        for chunk in iterPZZE(f, header=header):
+            data += chunk
+        return data
+
+
+def readTMD2(path, lazy = False, cache = None, precision = None):
+    #uncompressed files are mapped, so the vertex buffer is a view over the mapping
+    #cache is an optional tmd2cache.TMD2Cache that parsed files are loaded from and stored in
+    if cache is not None:
+        return cache.load(path, lazy, precision)
+    
+    file_name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "rb") as f:
+        if f.read(4) == b"PZZE":
+            source = readTMD2Data(path)
+        else:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    #only the header is copied into the reader, the sections are read from source
+    br = BinaryReader(source[:HEADER_READ_SIZE])
+    return br.read_struct(TMD2, None, file_name, lazy, source, None, precision)
+
+
 CRC32TABLE = [
     0x00000000, 0x77073096, 0xEE0E612C, 0x990951BA, 0x076DC419, 0x706AF48F, 0xE963A535, 0x9E6495A3,
 	0x0EDB8832, 0x79DCB8A4, 0xE0D5E91E, 0x97D2D988, 0x09B64C2B, 0x7EB17CBD, 0xE7B82D07, 0x90BF1D91,
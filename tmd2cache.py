@@ -0,0 +1,139 @@
+from .utils.PyBinaryReader.binary_reader import *
+from .tmd2 import TMD2, readTMD2Data, BONE_ARRAYS, SUBMESH_ARRAYS, HEADER_READ_SIZE
+from .blobstore import hashBytes
+import numpy as np
+import shutil
+import uuid
+import json
+import mmap
+import time
+import os
+
+#bumped whenever the cached layout or the decoded arrays change, older entries are simply never hit
+CACHE_VERSION = 1
+CACHE_ARRAYS = BONE_ARRAYS + SUBMESH_ARRAYS
+DEFAULT_CACHE_SIZE = 1 << 30
+
+
+class TMD2Cache:
+    #on-disk cache of parsed TMD2 files, every entry is a folder holding
+    #  model.tmd0   the decompressed file, vertices and triangles are views into its mapping
+    #  <name>.npy   decoded bone and submesh arrays, memory mapped copy-on-write on load
+    #  meta.json    written last, an entry without it is incomplete
+    #entries are keyed by path, size and mtime ("stat") or by a hash of the decompressed bytes ("content")
+    #the least recently used entries are evicted once the cache grows past maxSize bytes
+    def __init__(self, root, maxSize = DEFAULT_CACHE_SIZE, keyMode = "stat"):
+        if keyMode not in ("stat", "content"):
+            raise ValueError(f"Unknown key mode: {keyMode}")
+        self.root = root
+        self.maxSize = maxSize
+        self.keyMode = keyMode
+        os.makedirs(root, exist_ok=True)
+
+    def statKey(self, path):
+        stat = os.stat(path)
+        return f"v{CACHE_VERSION}-" + hashBytes(f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}".encode("utf-8"))
+
+    def contentKey(self, data):
+        return f"v{CACHE_VERSION}-" + hashBytes(data)
+
+    def entryPath(self, key):
+        return os.path.join(self.root, key)
+
+    def has(self, key):
+        return os.path.exists(os.path.join(self.entryPath(key), "meta.json"))
+
+    def load(self, path, lazy = False, precision = None):
+        #returns the parsed TMD2, from the cache when possible, otherwise it is parsed and stored
+        file_name = os.path.splitext(os.path.basename(path))[0]
+        data = None
+        if self.keyMode == "stat":
+            key = self.statKey(path)
+        else:
+            data = readTMD2Data(path)
+            key = self.contentKey(data)
+
+        if self.has(key):
+            try:
+                return self.loadEntry(key, file_name, lazy, precision)
+            except (OSError, ValueError):
+                #a damaged entry is rebuilt below
+                shutil.rmtree(self.entryPath(key), ignore_errors=True)
+
+        if data is None:
+            data = readTMD2Data(path)
+        br = BinaryReader(data[:HEADER_READ_SIZE])
+        tmd = br.read_struct(TMD2, None, file_name, False, data, None, precision)
+        self.store(key, data, tmd, path)
+        self.evict()
+        return tmd
+
+    def loadEntry(self, key, file_name = "", lazy = False, precision = None):
+        entry = self.entryPath(key)
+        with open(os.path.join(entry, "model.tmd0"), "rb") as f:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        arrays = {name: np.load(os.path.join(entry, f"{name}.npy"), mmap_mode="c") for name in CACHE_ARRAYS
+                  if os.path.exists(os.path.join(entry, f"{name}.npy"))}
+
+        #meta.json is touched on every hit, eviction orders entries by its mtime
+        os.utime(os.path.join(entry, "meta.json"))
+        #only the header is copied, the sections are read from the mapping
+        br = BinaryReader(source[:HEADER_READ_SIZE])
+        return br.read_struct(TMD2, None, file_name, lazy, source, arrays, precision)
+
+    def store(self, key, data, tmd: TMD2, path = ""):
+        #the entry is written into a temporary folder and renamed into place so readers never see half of it
+        entry = self.entryPath(key)
+        tmpEntry = os.path.join(self.root, f".{key}.{uuid.uuid4().hex}.tmp")
+        os.makedirs(tmpEntry)
+        try:
+            with open(os.path.join(tmpEntry, "model.tmd0"), "wb") as f:
+                f.write(data)
+            for name in CACHE_ARRAYS:
+                np.save(os.path.join(tmpEntry, f"{name}.npy"), np.ascontiguousarray(getattr(tmd, name)))
+
+            with open(os.path.join(tmpEntry, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_VERSION, "path": os.path.abspath(path) if path else "",
+                           "size": len(data), "created": time.time()}, f)
+
+            try:
+                os.replace(tmpEntry, entry)
+            except OSError:
+                #another process stored the same entry first
+                pass
+        finally:
+            shutil.rmtree(tmpEntry, ignore_errors=True)
+
+    def entries(self):
+        #(key, size in bytes, last use) of every complete entry
+        result = []
+        for key in os.listdir(self.root):
+            entry = self.entryPath(key)
+            metaPath = os.path.join(entry, "meta.json")
+            if key.startswith(".") or not os.path.exists(metaPath):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+            result.append((key, size, os.stat(metaPath).st_mtime))
+        return result
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, maxSize = None):
+        #removes least recently used entries until the cache fits in maxSize
+        if maxSize is None:
+            maxSize = self.maxSize
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for key, size, _ in entries:
+            if total <= maxSize:
+                break
+            shutil.rmtree(self.entryPath(key), ignore_errors=True)
+            total -= size
+            removed.append(key)
+        return removed
+
+    def clear(self):
+        return self.evict(0)
+
@@ -0,0 +1,235 @@
+from collections import namedtuple
+from .meshops import quantizeWeights8
+import numpy as np
+
+
+#kind decides how an attribute is decoded and encoded:
+#  raw      stored as is (positions, bone ids, TMD2 uvs)
+#  normal   u1 mapped from [-1, 1], the 4th byte is the constant pad
+#  unorm8   u1 mapped from [0, 1] (colors)
+#  weights  u1 weights, both weight slots of a vertex are quantized together so they sum to 255
+#  uv1024   u2 fixed point with 1/1024 steps (TMD uvs)
+VertexAttribute = namedtuple("VertexAttribute", ["name", "flag", "readType", "count", "kind", "pad"])
+
+#modelFlags -> attributes in buffer order, TMD and TMD2 only differ in how uvs are stored
+VERTEX_ATTRIBUTES = {
+    "tmd2": [
+        VertexAttribute("position", 0x2, "f4", 3, "raw", 0),
+        VertexAttribute("boneWeights", 0x400, "u1", 4, "weights", 0),
+        VertexAttribute("boneIDs", 0x400, "u1", 4, "raw", 0),
+        VertexAttribute("boneWeights2", 0x8000, "u1", 4, "weights", 0),
+        VertexAttribute("boneIDs2", 0x8000, "u1", 4, "raw", 0),
+        VertexAttribute("normal", 0x4, "u1", 4, "normal", 255),
+        VertexAttribute("tangent", 0x8, "u1", 4, "normal", 0),
+        VertexAttribute("binormal", 0x8, "u1", 4, "normal", 0),
+        VertexAttribute("color", 0x80, "u1", 4, "unorm8", 0),
+        VertexAttribute("normal2", 0x100, "u1", 4, "normal", 255),
+        VertexAttribute("color2", 0x200, "u1", 4, "unorm8", 0),
+        VertexAttribute("uv", 0x10, "f4", 2, "raw", 0),
+        VertexAttribute("uv2", 0x20, "f4", 2, "raw", 0),
+        VertexAttribute("uv3", 0x40, "f4", 2, "raw", 0),
+    ],
+}
+VERTEX_ATTRIBUTES["tmd"] = [attribute._replace(readType="u2", kind="uv1024") if attribute.name.startswith("uv") else attribute
+                            for attribute in VERTEX_ATTRIBUTES["tmd2"]]
+
+
+def unpack_normals(v):
+    # Strip 4th component and normalize XYZ
+    f = ((v[..., :3].astype(np.float32) / 255.0) * 2.0) - 1.0
+    norm = np.linalg.norm(f, axis=-1, keepdims=True)
+    norm[norm == 0] = 1.0
+    return f / norm
+
+def unpack_normals4(v):
+    #TMD2 keeps and normalizes all 4 components
+    f = ((v.astype(np.float32) / 255.0) * 2.0) - 1.0
+    norm = np.linalg.norm(f, axis=-1, keepdims=True)
+    norm[norm == 0] = 1.0
+    return f / norm
+
+def unpack_unorm8(v):
+    return v.astype(np.float32) / 255.0
+
+def unpack_uv(v):
+    return v.astype(np.float32) / 1024.0
+
+
+#decoders per format and kind, raw attributes are not converted
+DECODERS = {
+    "tmd": {"normal": unpack_normals, "unorm8": unpack_unorm8, "weights": unpack_unorm8, "uv1024": unpack_uv},
+    "tmd2": {"normal": unpack_normals4, "unorm8": unpack_unorm8, "weights": unpack_unorm8},
+}
+
+#attribute name -> decoder of every format, used as VertexBuffer.converters
+VERTEX_CONVERTERS = {fmt: {attribute.name: DECODERS[fmt][attribute.kind] for attribute in attributes if attribute.kind in DECODERS[fmt]}
+                     for fmt, attributes in VERTEX_ATTRIBUTES.items()}
+
+
+def pack_normals(values, pad):
+    values = np.asarray(values, dtype=np.float64)
+    if values.shape[-1] == 4:
+        #decoded TMD2 normals were normalized together with the +-1 pad, dividing by it restores XYZ
+        w = np.abs(values[..., 3:])
+        values = np.divide(values[..., :3], w, out=values[..., :3].copy(), where=w > 0)
+    values = values[..., :3]
+    packed = np.empty(values.shape[:-1] + (4,), dtype=np.uint8)
+    packed[..., :3] = np.clip(np.trunc((values * 0.5 + 0.5) * 255 + 0.5), 0, 255)
+    packed[..., 3] = pad
+    return packed
+
+def pack_unorm8(values):
+    return np.clip(np.trunc(np.asarray(values, dtype=np.float64) * 255), 0, 255).astype(np.uint8)
+
+def pack_uv(values):
+    return np.clip(np.trunc(np.asarray(values, dtype=np.float64) * 1024), 0, 0xFFFF).astype(np.uint16)
+
+
+class VertexLayout:
+    #vertex buffer layout of one (format, modelFlags) pair
+    #readDtype matches the file, decodedDtype is what decode produces, encode goes the other way in bulk
+    def __init__(self, fmt, modelFlags):
+        if fmt not in VERTEX_ATTRIBUTES:
+            raise ValueError(f"Unknown vertex format: {fmt}")
+        self.format = fmt
+        self.modelFlags = modelFlags
+        self.attributes = [attribute for attribute in VERTEX_ATTRIBUTES[fmt] if modelFlags & attribute.flag]
+        self.readDtype = np.dtype([(attribute.name, attribute.readType, attribute.count) for attribute in self.attributes])
+        self.converters = {attribute.name: VERTEX_CONVERTERS[fmt][attribute.name] for attribute in self.attributes
+                           if attribute.name in VERTEX_CONVERTERS[fmt]}
+
+        decoded = []
+        for attribute in self.attributes:
+            if attribute.name in self.converters:
+                shape = self.converters[attribute.name](np.zeros((0, attribute.count), attribute.readType)).shape[1:]
+                decoded.append((attribute.name, np.float32, shape))
+            else:
+                decoded.append((attribute.name, attribute.readType, attribute.count))
+        self.decodedDtype = np.dtype(decoded)
+
+    @property
+    def names(self):
+        return self.readDtype.names
+
+    @property
+    def stride(self):
+        return self.readDtype.itemsize
+
+    def fromBuffer(self, buffer, count, offset = 0):
+        return np.frombuffer(buffer, self.readDtype, count, offset)
+
+    def decodeAttribute(self, name, values):
+        if name in self.converters:
+            return self.converters[name](values)
+        return values
+
+    def decode(self, raw):
+        #structured array in decodedDtype
+        decoded = np.empty(raw.shape, dtype=self.decodedDtype)
+        for name in self.names:
+            decoded[name] = self.decodeAttribute(name, raw[name])
+        return decoded
+
+    @property
+    def hasWeights(self):
+        return any(attribute.kind == "weights" for attribute in self.attributes)
+
+    def weights(self, columns, count):
+        #(count, 8) float weights of both weight slots, missing slots are zero
+        weights = np.zeros((count, 8), dtype=np.float64)
+        for slot, name in enumerate(("boneWeights", "boneWeights2")):
+            if hasColumn(columns, name):
+                values = np.asarray(columns[name])
+                #weights kept quantized ("u1" precision) are requantized from their byte values
+                weights[:, slot * 4: slot * 4 + 4] = values / 255.0 if values.dtype == np.uint8 else values
+        return weights
+
+    def encode(self, columns, count = None, packedWeights = None, weightMethod = "round"):
+        #columns maps attribute names to decoded (N, k) values, a structured array works as well
+        #missing attributes are written as zeros, boneWeights and boneWeights2 are quantized together
+        #unless packedWeights already holds the (N, 8) bytes from quantizeWeights8
+        if count is None:
+            count = len(next((columns[name] for name in self.names if hasColumn(columns, name)), ()))
+        raw = np.zeros(count, dtype=self.readDtype)
+
+        if self.hasWeights:
+            if packedWeights is None:
+                packedWeights = quantizeWeights8(self.weights(columns, count), weightMethod)
+            for attribute in self.attributes:
+                if attribute.kind == "weights":
+                    raw[attribute.name] = packedWeights[:, :4] if attribute.name == "boneWeights" else packedWeights[:, 4:]
+
+        for attribute in self.attributes:
+            if attribute.kind == "weights" or not hasColumn(columns, attribute.name):
+                continue
+            values = np.asarray(columns[attribute.name])
+            if values.dtype == attribute.readType:
+                #already quantized, e.g. a VertexBuffer column kept at "u1"
+                raw[attribute.name] = values
+            elif attribute.kind == "normal":
+                raw[attribute.name] = pack_normals(values, attribute.pad)
+            elif attribute.kind == "unorm8":
+                raw[attribute.name] = pack_unorm8(values)
+            elif attribute.kind == "uv1024":
+                raw[attribute.name] = pack_uv(values)
+            else:
+                raw[attribute.name] = values
+        return raw
+
+    def gather(self, vertices):
+        #columns of per-vertex objects (TMDVertex/TMD2Vertex), one array per attribute
+        names = list(self.names)
+        if self.hasWeights:
+            names += [name for name in ("boneWeights", "boneWeights2") if name not in names]
+        return {name: np.array([getattr(vertex, name) for vertex in vertices], dtype=np.float64).reshape(len(vertices), -1)
+                for name in names}
+
+    def columns(self, vertices):
+        #decoded columns of a vertex list or array, None for a raw array that is written as is
+        if isinstance(vertices, np.ndarray):
+            return None if vertices.dtype == self.readDtype else vertices
+        return self.gather(vertices)
+
+    def encodeVertices(self, vertices, weightMethod = "round"):
+        #vertices is a structured array, either raw (readDtype, passed through) or decoded, or a list of vertex objects
+        if len(vertices) == 0:
+            return np.zeros(0, dtype=self.readDtype)
+        columns = self.columns(vertices)
+        if columns is None:
+            return vertices
+        return self.encode(columns, len(vertices), weightMethod=weightMethod)
+
+    def encodeChunks(self, chunks, weightMethod = "round"):
+        #packed vertex buffer bytes of several vertex lists or arrays (one per submesh) in order
+        return self.encodeArray(chunks, weightMethod).tobytes()
+
+    def encodeArray(self, chunks, weightMethod = "round"):
+        #same as encodeChunks but returns the vertex buffer as one readDtype array
+        #the skin weights of every chunk are quantized in one batch
+        chunks = [chunk for chunk in chunks if len(chunk)]
+        if not chunks:
+            return np.zeros(0, dtype=self.readDtype)
+        columns = [self.columns(chunk) for chunk in chunks]
+
+        packedWeights = None
+        if self.hasWeights:
+            weights = [self.weights(chunkColumns, len(chunk)) for chunk, chunkColumns in zip(chunks, columns) if chunkColumns is not None]
+            if weights:
+                packedWeights = quantizeWeights8(np.concatenate(weights), weightMethod)
+
+        encoded = []
+        start = 0
+        for chunk, chunkColumns in zip(chunks, columns):
+            if chunkColumns is None:
+                encoded.append(chunk)
+                continue
+            chunkWeights = None if packedWeights is None else packedWeights[start:start + len(chunk)]
+            encoded.append(self.encode(chunkColumns, len(chunk), chunkWeights))
+            start += len(chunk)
+        return np.concatenate(encoded)
+
+
+def hasColumn(columns, name):
+    if isinstance(columns, np.ndarray):
+        return columns.dtype.names is not None and name in columns.dtype.names
+    return name in columns